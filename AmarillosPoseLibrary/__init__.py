@@ -0,0 +1,3084 @@
+import bpy
+import bpy.utils.previews
+import csv
+import gpu
+import hashlib
+import io
+import json
+import numpy
+import os
+import re
+import sqlite3
+import struct
+import time
+import zipfile
+import zlib
+from bpy.app.handlers import persistent
+from collections import OrderedDict, deque
+from fnmatch import fnmatchcase
+
+from .library_format import (
+    LIBRARY_ARCHIVE_MANIFEST,
+    POSE_CHANNEL_WIDTH,
+    POSE_CHANNELS,
+    REST_POSE_VALUES,
+    ArmaturePose,
+    LibraryFileReader,
+    armature_pose_hash,
+    bone_names_key,
+    decode_pose_payload,
+    encode_pose_payload,
+    export_entry_payload,
+    is_legacy_pose_payload,
+    library_to_export_json,
+    pose_from_export_data,
+    pose_payload_hash,
+    sparse_armature_pose,
+    write_library_archive,
+)
+
+bl_info = {
+    "name": "Amarillo's Pose Library",
+    "blender": (4, 2, 0),
+    "category": "Object",
+    "version": (1, 0, 17),
+    "author": "Your Name",
+    "description": "Save and manage multiple pose libraries per Blender file.",
+}
+
+addon_name = 'AmarillosPoseLibrary'  # Keep the original addon name for preferences
+
+def update_background_upgrades(self, context):
+    if self.upgrade_in_background:
+        library_upgrader.schedule()
+
+class AmarilloExpressionsPreferences(bpy.types.AddonPreferences):
+    bl_idname = addon_name  # Keep the original bl_idname
+
+    armature_names: bpy.props.StringProperty(
+        name="Default Armature Names",
+        description="Comma-separated list of default armature names to include when saving poses",
+        default=""
+    )
+    
+    reset_unsaved_bones: bpy.props.BoolProperty(
+        name="Reset Unsaved Bones to Initial Transform",
+        description="Reset all bones not present in the saved pose to their initial transforms (position zero, rotation zero, scale one)",
+        default=True
+    )
+
+    compress_pose_data: bpy.props.BoolProperty(
+        name="Compress Pose Data",
+        description="Compress saved pose data to keep the .blend file small",
+        default=True
+    )
+
+    sparse_pose_storage: bpy.props.BoolProperty(
+        name="Only Save Posed Bones",
+        description="Leave bones at their rest transform out of saved poses. They are restored on load when Reset Unsaved Bones is enabled",
+        default=False
+    )
+
+    sparse_pose_tolerance: bpy.props.FloatProperty(
+        name="Rest Tolerance",
+        description="Largest difference from the rest transform for a bone to be left out of a saved pose",
+        default=1e-5,
+        min=0.0,
+        precision=6
+    )
+
+    thumbnail_size: bpy.props.IntProperty(
+        name="Thumbnail Size",
+        description="Resolution of the pose thumbnails shown in the grid view",
+        default=128,
+        min=32,
+        max=512
+    )
+
+    thumbnail_directory: bpy.props.StringProperty(
+        name="Thumbnail Cache",
+        description="Folder where pose thumbnails are cached. Leave empty to use Blender's user data folder",
+        subtype='DIR_PATH',
+        default=""
+    )
+
+    deduplicate_pose_data: bpy.props.BoolProperty(
+        name="Deduplicate Pose Data",
+        description="Store every distinct armature pose once per file and let the poses of all libraries share it",
+        default=True
+    )
+
+    upgrade_in_background: bpy.props.BoolProperty(
+        name="Upgrade Old Poses in Background",
+        description="Convert poses saved by older versions of the addon while Blender is idle. Otherwise they are converted the first time they are used",
+        default=True,
+        update=update_background_upgrades
+    )
+
+    pose_cache_size: bpy.props.IntProperty(
+        name="Pose Cache Size (MB)",
+        description="Memory used to keep recently loaded poses decoded. Set to zero to disable the cache",
+        default=64,
+        min=0,
+        soft_max=1024
+    )
+
+    def draw(self, context):
+        layout = self.layout
+        layout.label(text="Default Armature Names:")
+        layout.prop(self, "armature_names", text="")
+        layout.prop(self, "reset_unsaved_bones")
+        layout.prop(self, "compress_pose_data")
+        layout.prop(self, "sparse_pose_storage")
+        if self.sparse_pose_storage:
+            layout.prop(self, "sparse_pose_tolerance")
+        row = layout.row()
+        row.prop(self, "deduplicate_pose_data")
+        row.operator("amarillo_pose.deduplicate", text="Deduplicate Now")
+        row = layout.row()
+        row.prop(self, "upgrade_in_background")
+        row.operator("amarillo_pose.upgrade_libraries", text="Upgrade Now")
+        layout.prop(self, "thumbnail_size")
+        layout.prop(self, "thumbnail_directory")
+        layout.prop(self, "pose_cache_size")
+        cache = decoded_pose_cache
+        layout.label(text=f"Cached poses: {len(cache.entries)} ({cache.size / 1048576:.1f} MB), {cache.hits} hits, {cache.misses} misses")
+
+def pose_list_changed(self, context):
+    pose_list_filter_cache.touch()
+
+def pose_name_changed(self, context):
+    pose_list_filter_cache.touch()
+    pose_name_index.named(self.name)
+
+class PoseItem(bpy.types.PropertyGroup):
+    name: bpy.props.StringProperty(name="Pose Name", update=pose_name_changed)
+    data: bpy.props.StringProperty(name="Pose Data")
+    tags: bpy.props.StringProperty(name="Tags", description="Comma separated tags to filter the pose list by", update=pose_list_changed)
+
+class PoseBlock(bpy.types.PropertyGroup):
+    name: bpy.props.StringProperty(name="Content Hash")
+    data: bpy.props.StringProperty(name="Armature Pose Data")
+    users: bpy.props.IntProperty(name="Users", default=0)
+
+class PoseBoneSetBone(bpy.types.PropertyGroup):
+    name: bpy.props.StringProperty(name="Bone Name")
+
+class PoseBoneSet(bpy.types.PropertyGroup):
+    name: bpy.props.StringProperty(name="Bone Set Name")
+    bones: bpy.props.CollectionProperty(type=PoseBoneSetBone)
+
+class PoseSimilarityResult(bpy.types.PropertyGroup):
+    name: bpy.props.StringProperty(name="Pose Name")
+    distance: bpy.props.FloatProperty(name="Distance")
+
+class PoseLibraryItem(bpy.types.PropertyGroup):
+    name: bpy.props.StringProperty(name="Library Name")
+    poses: bpy.props.CollectionProperty(type=PoseItem)
+    poses_index: bpy.props.IntProperty(name="Index for poses", default=0)
+    storage: bpy.props.EnumProperty(
+        name="Storage",
+        items=(
+            ('EMBEDDED', 'Embedded', "Pose data is saved in the .blend file"),
+            ('DATABASE', 'Database', "Pose data is kept in an external pose database shared between .blend files"),
+        ),
+        default='EMBEDDED'
+    )
+    database_path: bpy.props.StringProperty(name="Pose Database", subtype='FILE_PATH')
+    database_library: bpy.props.StringProperty(name="Database Library", description="Name of the library inside the pose database")
+    schema_version: bpy.props.IntProperty(name="Schema Version", default=0)
+    upgrade_position: bpy.props.IntProperty(default=0)
+
+def capture_pose_values(obj):
+    bones = obj.pose.bones
+    count = len(bones)
+    values = numpy.empty((count, POSE_CHANNEL_WIDTH), dtype=numpy.float32)
+    for attr, start, width in POSE_CHANNELS:
+        buffer = numpy.empty(count * width, dtype=numpy.float32)
+        bones.foreach_get(attr, buffer)
+        values[:, start:start + width] = buffer.reshape(count, width)
+    return values
+
+# Bone sets smaller than this fraction of the rig are read and written bone by bone
+# instead of through foreach_get/foreach_set over every bone
+MASKED_BONE_LOOP_FACTOR = 8
+
+def capture_masked_pose_values(obj, bone_indices):
+    bones = obj.pose.bones
+    if len(bone_indices) * MASKED_BONE_LOOP_FACTOR >= len(bones):
+        return capture_pose_values(obj)[bone_indices]
+    values = numpy.empty((len(bone_indices), POSE_CHANNEL_WIDTH), dtype=numpy.float32)
+    for row, bone_index in enumerate(bone_indices):
+        bone = bones[int(bone_index)]
+        values[row, 0:3] = bone.location
+        values[row, 3:7] = bone.rotation_quaternion
+        values[row, 7:10] = bone.scale
+    return values
+
+def capture_armature_pose(obj, bone_indices=None):
+    bone_names = obj.pose.bones.keys()
+    if bone_indices is None:
+        return ArmaturePose(bone_names, capture_pose_values(obj))
+    return ArmaturePose([bone_names[bone_index] for bone_index in bone_indices], capture_masked_pose_values(obj, bone_indices))
+
+def apply_pose_values(obj, values):
+    bones = obj.pose.bones
+    for attr, start, width in POSE_CHANNELS:
+        bones.foreach_set(attr, numpy.ascontiguousarray(values[:, start:start + width]).ravel())
+    obj.update_tag()
+
+def apply_masked_pose_values(obj, bone_indices, values):
+    # values holds one row per entry of bone_indices, the other bones are left untouched
+    bones = obj.pose.bones
+    if len(bone_indices) * MASKED_BONE_LOOP_FACTOR >= len(bones):
+        pose_values = capture_pose_values(obj)
+        pose_values[bone_indices] = values
+        apply_pose_values(obj, pose_values)
+        return
+    for row, bone_index in enumerate(bone_indices):
+        bone = bones[int(bone_index)]
+        bone.location = values[row, 0:3]
+        bone.rotation_quaternion = values[row, 3:7]
+        bone.scale = values[row, 7:10]
+    obj.update_tag()
+
+class BoneMapping:
+    # Gather/scatter indices from a stored bone order onto an armature's pose bones
+    __slots__ = ('targets', 'rows', 'bone_count', 'missing', 'identity', 'reset_values', 'row_lookup')
+
+    def __init__(self, pose_bone_names, stored_bone_names):
+        bone_lookup = {bone_name: index for index, bone_name in enumerate(pose_bone_names)}
+        targets = []
+        rows = []
+        for row, bone_name in enumerate(stored_bone_names):
+            index = bone_lookup.get(bone_name)
+            if index is not None:
+                targets.append(index)
+                rows.append(row)
+        self.targets = numpy.array(targets, dtype=numpy.intp)
+        self.rows = numpy.array(rows, dtype=numpy.intp)
+        self.bone_count = len(pose_bone_names)
+        self.missing = len(stored_bone_names) - len(rows)
+        self.identity = targets == rows and len(targets) == self.bone_count
+
+        # Bones outside the saved pose fall back to the rest transform
+        self.reset_values = numpy.empty((self.bone_count, POSE_CHANNEL_WIDTH), dtype=numpy.float32)
+        unsaved = numpy.ones(self.bone_count, dtype=bool)
+        unsaved[self.targets] = False
+        self.reset_values[unsaved] = REST_POSE_VALUES
+
+        # Stored row of every pose bone, -1 for bones outside the saved pose
+        self.row_lookup = numpy.full(self.bone_count, -1, dtype=numpy.intp)
+        self.row_lookup[self.targets] = self.rows
+
+    def pose_values(self, obj, values, reset_unsaved_bones):
+        if self.identity:
+            return values
+        pose_values = self.reset_values.copy() if reset_unsaved_bones else capture_pose_values(obj)
+        pose_values[self.targets] = values[self.rows]
+        return pose_values
+
+    def masked_pose_values(self, obj, values, reset_unsaved_bones, bone_indices):
+        # Values of the bones in bone_indices only. Unsaved bones of the set get the rest
+        # transform or keep their current one
+        rows = self.row_lookup[bone_indices]
+        saved = rows >= 0
+        if reset_unsaved_bones or saved.all():
+            masked_values = numpy.tile(REST_POSE_VALUES, (len(bone_indices), 1))
+        else:
+            masked_values = capture_masked_pose_values(obj, bone_indices)
+        masked_values[saved] = values[rows[saved]]
+        return masked_values
+
+    def mirrored_pose_values(self, obj, values, reset_unsaved_bones, symmetry):
+        # Saved bones land on their mirror bones, unsaved ones keep their rest or current transform
+        full_values = self.reset_values.copy()
+        full_values[self.targets] = values[self.rows]
+        saved = numpy.zeros(self.bone_count, dtype=bool)
+        saved[self.targets] = True
+        full_values = symmetry.flip(full_values)
+        saved = saved[symmetry.sources]
+        if reset_unsaved_bones or saved.all():
+            return full_values
+        pose_values = capture_pose_values(obj)
+        pose_values[saved] = full_values[saved]
+        return pose_values
+
+# Mappings are keyed by stored layout and skeleton, so a changed bone set gets a new entry
+# and duplicated rigs with identical skeletons share one
+BONE_MAPPING_CACHE_SIZE = 256
+bone_mapping_cache = OrderedDict()
+
+def get_bone_mapping(obj, armature_pose):
+    pose_bone_names = obj.pose.bones.keys()
+    key = (armature_pose.layout_key, bone_names_key(pose_bone_names))
+    mapping = bone_mapping_cache.get(key)
+    if mapping is None:
+        mapping = BoneMapping(pose_bone_names, armature_pose.bone_names)
+        bone_mapping_cache[key] = mapping
+        if len(bone_mapping_cache) > BONE_MAPPING_CACHE_SIZE:
+            bone_mapping_cache.popitem(last=False)
+    else:
+        bone_mapping_cache.move_to_end(key)
+    return mapping
+
+# Bone set masks are keyed by skeleton and set contents, so editing either gets a new mask
+BONE_SET_CACHE_SIZE = 256
+bone_set_cache = OrderedDict()
+
+def get_bone_set_indices(obj, set_name):
+    # Sorted pose bone indices of a named bone set of obj, or None when obj has no such set
+    bone_set = obj.pose_bone_sets.get(set_name) if set_name else None
+    if bone_set is None:
+        return None
+    pose_bone_names = obj.pose.bones.keys()
+    set_bone_names = tuple(bone.name for bone in bone_set.bones)
+    key = (bone_names_key(pose_bone_names), bone_names_key(set_bone_names))
+    bone_indices = bone_set_cache.get(key)
+    if bone_indices is None:
+        bone_lookup = {bone_name: index for index, bone_name in enumerate(pose_bone_names)}
+        bone_indices = numpy.array(sorted({bone_lookup[bone_name] for bone_name in set_bone_names if bone_name in bone_lookup}), dtype=numpy.intp)
+        bone_set_cache[key] = bone_indices
+        if len(bone_set_cache) > BONE_SET_CACHE_SIZE:
+            bone_set_cache.popitem(last=False)
+    else:
+        bone_set_cache.move_to_end(key)
+    return bone_indices
+
+BONE_SIDE_SWAP = {"L": "R", "R": "L", "l": "r", "r": "l", "Left": "Right", "Right": "Left", "left": "right", "right": "left", "LEFT": "RIGHT", "RIGHT": "LEFT"}
+BONE_SIDE_SUFFIX = re.compile(r"[._\- ](L|R|l|r)(\.\d+)?$")
+BONE_SIDE_PREFIX = re.compile(r"^(L|R|l|r)[._\- ]")
+BONE_SIDE_WORD = re.compile(r"Left|Right|left|right|LEFT|RIGHT")
+
+def mirror_bone_name(bone_name):
+    # Other side of a bone named like Blender does: "hand.L", "hand_r", "L_hand", "LeftHand"
+    match = BONE_SIDE_SUFFIX.search(bone_name) or BONE_SIDE_PREFIX.search(bone_name) or BONE_SIDE_WORD.search(bone_name)
+    if match is None:
+        return bone_name
+    group = 1 if match.re is not BONE_SIDE_WORD else 0
+    return bone_name[:match.start(group)] + BONE_SIDE_SWAP[match.group(group)] + bone_name[match.end(group):]
+
+class BoneSymmetry:
+    # For every bone, the index of its mirror bone (itself for center bones and bones
+    # without a counterpart on the other side)
+    __slots__ = ('sources', 'pairs')
+
+    def __init__(self, bone_names):
+        bone_lookup = {bone_name: index for index, bone_name in enumerate(bone_names)}
+        self.sources = numpy.array([bone_lookup.get(mirror_bone_name(bone_name), index) for index, bone_name in enumerate(bone_names)], dtype=numpy.intp)
+        self.pairs = int(numpy.count_nonzero(self.sources != numpy.arange(len(bone_names)))) // 2
+
+    def flip(self, values):
+        # Swaps sides and mirrors across the X axis: location x and quaternion y and z change sign
+        flipped = values[self.sources]
+        flipped[:, (0, 5, 6)] *= -1
+        return flipped
+
+# Keyed by skeleton like the bone mappings, so renamed, added or removed bones get a new table
+BONE_SYMMETRY_CACHE_SIZE = 64
+bone_symmetry_cache = OrderedDict()
+
+def get_bone_symmetry(obj):
+    pose_bone_names = obj.pose.bones.keys()
+    key = bone_names_key(pose_bone_names)
+    symmetry = bone_symmetry_cache.get(key)
+    if symmetry is None:
+        symmetry = bone_symmetry_cache[key] = BoneSymmetry(pose_bone_names)
+        if len(bone_symmetry_cache) > BONE_SYMMETRY_CACHE_SIZE:
+            bone_symmetry_cache.popitem(last=False)
+    else:
+        bone_symmetry_cache.move_to_end(key)
+    return symmetry
+
+class PoseBlend:
+    # Lerps location/scale and slerps quaternions between two pose arrays of one armature, with
+    # one row per bone of the armature or of its active bone set
+    def __init__(self, start, target):
+        self.start = start
+        self.target = target.copy()
+        dot = numpy.einsum('ij,ij->i', start[:, 3:7], self.target[:, 3:7])
+        # q and -q are the same rotation, blend along the shorter arc
+        self.target[dot < 0, 3:7] *= -1
+        self.theta = numpy.arccos(numpy.clip(numpy.abs(dot), 0.0, 1.0))
+        sin_theta = numpy.sin(self.theta)
+        self.linear = sin_theta < 1e-5
+        self.sin_theta = numpy.where(self.linear, 1.0, sin_theta)
+
+    def values(self, factor):
+        result = self.start + (self.target - self.start) * factor
+        start_weight = numpy.where(self.linear, 1.0 - factor, numpy.sin((1.0 - factor) * self.theta) / self.sin_theta)
+        target_weight = numpy.where(self.linear, factor, numpy.sin(factor * self.theta) / self.sin_theta)
+        result[:, 3:7] = start_weight[:, None] * self.start[:, 3:7] + target_weight[:, None] * self.target[:, 3:7]
+        return result.astype(numpy.float32, copy=False)
+
+def insert_fcurve_keys(fcurve, frames, value):
+    # Overwrites keys already on one of the frames and appends the rest in one batch
+    points = fcurve.keyframe_points
+    count = len(points)
+    coordinates = numpy.empty(count * 2, dtype=numpy.float32)
+    points.foreach_get('co', coordinates)
+    coordinates = coordinates.reshape(count, 2)
+    coordinates[numpy.isin(coordinates[:, 0], frames), 1] = value
+
+    new_frames = frames[~numpy.isin(frames, coordinates[:, 0])]
+    if len(new_frames):
+        points.add(len(new_frames))
+        new_coordinates = numpy.column_stack((new_frames, numpy.full(len(new_frames), value, dtype=numpy.float32)))
+        coordinates = numpy.concatenate((coordinates, new_coordinates))
+    points.foreach_set('co', coordinates.ravel())
+    fcurve.update()
+
+def keyframe_pose_values(obj, values, frames, bone_indices=None):
+    # With bone_indices, values holds one row per listed bone and only those bones are keyed
+    animation_data = obj.animation_data or obj.animation_data_create()
+    action = animation_data.action
+    if action is None:
+        action = bpy.data.actions.new(f"{obj.name}Action")
+        animation_data.action = action
+
+    # Look existing curves up once and create the missing ones as they are reached
+    fcurves = {(fcurve.data_path, fcurve.array_index): fcurve for fcurve in action.fcurves}
+    frames = numpy.unique(numpy.asarray(frames, dtype=numpy.float32))
+    bone_names = obj.pose.bones.keys()
+    if bone_indices is None:
+        bone_indices = range(len(bone_names))
+    for row, bone_index in enumerate(bone_indices):
+        bone_name = bone_names[bone_index]
+        bone_path = f'pose.bones["{bpy.utils.escape_identifier(bone_name)}"]'
+        for attr, start, width in POSE_CHANNELS:
+            data_path = f"{bone_path}.{attr}"
+            for array_index in range(width):
+                fcurve = fcurves.get((data_path, array_index))
+                if fcurve is None:
+                    fcurve = action.fcurves.new(data_path, index=array_index, action_group=bone_name)
+                insert_fcurve_keys(fcurve, frames, values[row, start + array_index])
+
+def parse_frame_list(text):
+    # "1, 12, 24-30" -> [1, 12, 24, 25, ..., 30]
+    frames = []
+    for token in text.replace(",", " ").split():
+        first, separator, last = token.partition("-")
+        if separator and first:
+            frames.extend(range(int(first), int(last) + 1))
+        else:
+            frames.append(int(token))
+    return frames
+
+def pose_nbytes(pose):
+    return sum(
+        armature_pose.values.nbytes + sum(len(bone_name) for bone_name in armature_pose.bone_names)
+        for armature_pose in pose.values()
+    )
+
+class DecodedPoseCache:
+    # Bounded LRU of decoded poses keyed by (library name, pose name, payload hash)
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.latest_keys = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, pose, max_size):
+        # A newer payload for the same pose supersedes the old entry
+        stale_key = self.latest_keys.get(key[:2])
+        if stale_key is not None and stale_key != key:
+            self.discard(stale_key)
+
+        nbytes = pose_nbytes(pose)
+        if nbytes > max_size:
+            return
+        for armature_pose in pose.values():
+            armature_pose.values.flags.writeable = False
+        self.discard(key)
+        self.entries[key] = (pose, nbytes)
+        self.latest_keys[key[:2]] = key
+        self.size += nbytes
+        while self.size > max_size:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+            if self.latest_keys.get(key[:2]) == key:
+                del self.latest_keys[key[:2]]
+
+    def clear(self):
+        self.entries.clear()
+        self.latest_keys.clear()
+        self.size = 0
+
+decoded_pose_cache = DecodedPoseCache()
+
+class PoseStore:
+    # Single-file SQLite pose database that several .blend files can share. Poses are keyed
+    # by library and name and keep the hash of their payload, so a cached decode can be reused
+    # without fetching the payload again
+    def __init__(self, filepath):
+        self.connection = sqlite3.connect(filepath)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS poses ("
+            "library TEXT NOT NULL, name TEXT NOT NULL, data TEXT NOT NULL, hash TEXT NOT NULL, "
+            "PRIMARY KEY (library, name))"
+        )
+        self.connection.commit()
+
+    def pose_names(self, library):
+        rows = self.connection.execute("SELECT name FROM poses WHERE library = ? ORDER BY rowid", (library,))
+        return [row[0] for row in rows]
+
+    def pose_hash(self, library, name):
+        row = self.connection.execute("SELECT hash FROM poses WHERE library = ? AND name = ?", (library, name)).fetchone()
+        return row[0] if row else None
+
+    def read_pose(self, library, name):
+        row = self.connection.execute("SELECT data FROM poses WHERE library = ? AND name = ?", (library, name)).fetchone()
+        return row[0] if row else None
+
+    def write_poses(self, library, poses):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO poses (library, name, data, hash) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (library, name) DO UPDATE SET data = excluded.data, hash = excluded.hash",
+                [(library, name, data, pose_payload_hash(data)) for name, data in poses],
+            )
+
+    def delete_pose(self, library, name):
+        with self.connection:
+            self.connection.execute("DELETE FROM poses WHERE library = ? AND name = ?", (library, name))
+
+    def close(self):
+        self.connection.close()
+
+pose_stores = {}
+
+def get_pose_store(library):
+    filepath = os.path.normpath(bpy.path.abspath(library.database_path))
+    store = pose_stores.get(filepath)
+    if store is None:
+        store = pose_stores[filepath] = PoseStore(filepath)
+    return store
+
+def close_pose_stores():
+    for store in pose_stores.values():
+        store.close()
+    pose_stores.clear()
+
+def pose_payload_key(library, pose_item):
+    # Hash of the pose payload, or None when a database pose has no data
+    if library.storage == 'DATABASE':
+        return get_pose_store(library).pose_hash(library.database_library, pose_item.name)
+    return pose_payload_hash(pose_item.data)
+
+def read_pose_payload(library, pose_item):
+    if library.storage == 'DATABASE':
+        return get_pose_store(library).read_pose(library.database_library, pose_item.name)
+    if is_pose_reference(pose_item.data):
+        return encode_pose_payload(pose_block_store.resolve(library.id_data, pose_item.data), compress=False)
+    return pose_item.data
+
+def pose_content_hashes(pose):
+    return {armature_name: armature_pose_hash(armature_pose) for armature_name, armature_pose in pose.items()}
+
+def read_pose(library, pose_item):
+    # Decoded pose of a library item, or None when a database pose has no data
+    if library.storage == 'EMBEDDED' and is_pose_reference(pose_item.data):
+        return pose_block_store.resolve(library.id_data, pose_item.data)
+    data = read_pose_payload(library, pose_item)
+    return decode_pose_payload(data) if data else None
+
+def write_pose_payload(library, pose_item, data):
+    if library.storage == 'DATABASE':
+        get_pose_store(library).write_poses(library.database_library, [(pose_item.name, data)])
+    else:
+        pose_item.data = data
+
+# Deduplicated poses: PoseItem.data holds "APLREF:" and a JSON list of [armature name, hash]
+# pairs. Each hash names a PoseBlock of the scene holding that armature's payload once, with
+# a count of the references to it so unused blocks are removed
+POSE_REFERENCE_PREFIX = "APLREF:"
+
+def is_pose_reference(data):
+    return data.startswith(POSE_REFERENCE_PREFIX)
+
+def pose_reference_hashes(data):
+    return json.loads(data[len(POSE_REFERENCE_PREFIX):])
+
+class PoseBlockStore:
+    # Hash -> position maps of the blocks of each scene, keyed by scene pointer. Every block
+    # added goes through store(), so a hash missing from the map is not in the scene
+    def __init__(self):
+        self.indices = {}
+
+    def index_map(self, scene):
+        index_map = self.indices.get(scene.as_pointer())
+        if index_map is None:
+            index_map = self.indices[scene.as_pointer()] = {block.name: index for index, block in enumerate(scene.pose_blocks)}
+        return index_map
+
+    def find(self, scene, block_hash):
+        blocks = scene.pose_blocks
+        index = self.index_map(scene).get(block_hash)
+        if index is None:
+            return None
+        if index < len(blocks) and blocks[index].name == block_hash:
+            return blocks[index]
+        self.indices.pop(scene.as_pointer(), None)
+        index = self.index_map(scene).get(block_hash)
+        return blocks[index] if index is not None else None
+
+    def store(self, scene, pose, compress=True):
+        # Adds one user to the block of every armature and returns the reference payload
+        references = []
+        for armature_name, armature_pose in pose.items():
+            block_hash = armature_pose_hash(armature_pose)
+            block = self.find(scene, block_hash)
+            if block is None:
+                block = scene.pose_blocks.add()
+                block.name = block_hash
+                block.data = encode_pose_payload({"": armature_pose}, compress)
+                self.index_map(scene)[block_hash] = len(scene.pose_blocks) - 1
+            block.users += 1
+            references.append((armature_name, block_hash))
+        return POSE_REFERENCE_PREFIX + json.dumps(references, separators=(",", ":"))
+
+    def resolve(self, scene, data):
+        pose = {}
+        for armature_name, block_hash in pose_reference_hashes(data):
+            block = self.find(scene, block_hash)
+            if block is None:
+                raise KeyError(f"Pose data block {block_hash} is missing")
+            (pose[armature_name],) = decode_pose_payload(block.data).values()
+        return pose
+
+    def release(self, scene, *payloads):
+        # Drops one user per reference and removes the blocks nobody uses anymore
+        unused = set()
+        for data in payloads:
+            if not is_pose_reference(data):
+                continue
+            for armature_name, block_hash in pose_reference_hashes(data):
+                block = self.find(scene, block_hash)
+                if block is not None:
+                    block.users -= 1
+                    if block.users <= 0:
+                        unused.add(block_hash)
+        self.remove_blocks(scene, unused)
+
+    def remove_blocks(self, scene, block_hashes):
+        # Each block trades places with the last one and is removed from the end, so only the
+        # moved block's position changes and the map is updated in place
+        blocks = scene.pose_blocks
+        for block_hash in block_hashes:
+            if self.find(scene, block_hash) is None:
+                continue
+            index_map = self.index_map(scene)
+            index = index_map.pop(block_hash)
+            last = len(blocks) - 1
+            if index != last:
+                blocks.move(last, index)
+                blocks.move(index + 1, last)
+                index_map[blocks[index].name] = index
+            blocks.remove(last)
+
+    def embedded_references(self, scene):
+        for library in scene.pose_libraries:
+            if library.storage == 'EMBEDDED':
+                for pose_item in library.poses:
+                    if is_pose_reference(pose_item.data):
+                        yield from pose_reference_hashes(pose_item.data)
+
+    def collect_garbage(self, scene):
+        # Recounts the users of every block from the poses and removes orphans
+        users = {}
+        for armature_name, block_hash in self.embedded_references(scene):
+            users[block_hash] = users.get(block_hash, 0) + 1
+        for block in scene.pose_blocks:
+            block.users = users.get(block.name, 0)
+        orphans = {block.name for block in scene.pose_blocks if not block.users}
+        self.remove_blocks(scene, orphans)
+        return len(orphans)
+
+    def statistics(self, scene):
+        # (blocks, bytes stored in blocks, bytes saved compared to one copy per reference)
+        sizes = {block.name: len(block.data) for block in scene.pose_blocks}
+        referenced = sum(sizes.get(block_hash, 0) for armature_name, block_hash in self.embedded_references(scene))
+        stored = sum(sizes.values())
+        return len(sizes), stored, referenced - stored
+
+    def clear(self):
+        self.indices.clear()
+
+pose_block_store = PoseBlockStore()
+
+def encode_library_pose(library, pose, prefs):
+    # Embedded libraries store block references when deduplication is on. The caller
+    # releases the references of the payload this one replaces
+    if library.storage == 'EMBEDDED' and prefs.deduplicate_pose_data:
+        return pose_block_store.store(library.id_data, pose, prefs.compress_pose_data)
+    return encode_pose_payload(pose, prefs.compress_pose_data)
+
+class PoseNameIndex:
+    # Name -> position maps for the poses of each library, keyed by library pointer.
+    # Hits are verified against the collection so a stale map never returns the wrong
+    # pose. Every name given to a pose is recorded by named(), so only a miss on one of
+    # those names is confirmed with the collection's own lookup, other misses are trusted.
+    def __init__(self):
+        self.indices = {}
+        self.unindexed_names = set()
+
+    def rebuild(self, library):
+        index_map = {}
+        for index, pose_name in enumerate(library.poses.keys()):
+            index_map.setdefault(pose_name, index)
+        self.indices[library.as_pointer()] = index_map
+        return index_map
+
+    def find(self, library, name):
+        poses = library.poses
+        index_map = self.indices.get(library.as_pointer())
+        if index_map is None:
+            index_map = self.rebuild(library)
+
+        index = index_map.get(name)
+        if index is None:
+            if name not in self.unindexed_names:
+                return -1
+            index = poses.find(name)
+            if index >= 0:
+                index_map[name] = index
+            return index
+        if index < len(poses) and poses[index].name == name:
+            return index
+        return self.rebuild(library).get(name, -1)
+
+    def named(self, name):
+        self.unindexed_names.add(name)
+
+    def update(self, library, *positions):
+        index_map = self.indices.get(library.as_pointer())
+        if index_map is not None:
+            for index in positions:
+                index_map[library.poses[index].name] = index
+
+    def invalidate(self, library):
+        self.indices.pop(library.as_pointer(), None)
+
+    def clear(self):
+        self.indices.clear()
+        self.unindexed_names.clear()
+
+pose_name_index = PoseNameIndex()
+
+def parse_pose_tags(text):
+    return frozenset(tag.strip().lower() for tag in text.split(",") if tag.strip())
+
+def natural_sort_key(text):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", text)]
+
+class PoseListFilterEntry:
+    # Lowercased names, parsed tags and sort orders of one library, plus the results
+    # of the last few queries so redraws with an unchanged filter cost no string work
+    max_results = 16
+
+    def __init__(self, library, revision):
+        poses = library.poses
+        self.revision = revision
+        self.count = len(poses)
+        self.names = [pose_name.lower() for pose_name in poses.keys()]
+        self.tags = [parse_pose_tags(pose.tags) for pose in poses]
+        self.orders = {}
+        self.results = OrderedDict()
+
+    def order(self, sort_order):
+        # New position of every pose, in the layout UIList.filter_items expects
+        neworder = self.orders.get(sort_order)
+        if neworder is None:
+            if sort_order == 'NAME':
+                positions = sorted(range(self.count), key=lambda index: natural_sort_key(self.names[index]))
+            elif sort_order == 'TAGS':
+                positions = sorted(range(self.count), key=lambda index: (not self.tags[index], sorted(self.tags[index]), natural_sort_key(self.names[index])))
+            else:
+                positions = None
+            neworder = self.orders[sort_order] = positions_to_neworder(positions) if positions else []
+        return neworder
+
+    def filter(self, query, tag_query, fuzzy, sort_order, bitflag):
+        key = (query, tag_query, fuzzy, sort_order, bitflag)
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+            return result
+
+        query = query.strip().lower()
+        scores = None
+        if query and fuzzy:
+            # Letters of the query in order, anywhere in the name. Tighter and earlier matches rank first
+            pattern = re.compile(".*?".join(map(re.escape, query)))
+            matches = [pattern.search(pose_name) for pose_name in self.names]
+            visible = [match is not None for match in matches]
+            scores = [(match.end() - match.start(), match.start()) if match else (0, 0) for match in matches]
+        elif query:
+            visible = [query in pose_name for pose_name in self.names]
+        else:
+            visible = [True] * self.count
+
+        required_tags = parse_pose_tags(tag_query)
+        if required_tags:
+            visible = [shown and required_tags <= tags for shown, tags in zip(visible, self.tags)]
+
+        flags = [bitflag if shown else 0 for shown in visible]
+        if sort_order == 'RELEVANCE' and scores:
+            neworder = positions_to_neworder(sorted(range(self.count), key=lambda index: (not visible[index], scores[index], index)))
+        else:
+            neworder = self.order(sort_order)
+
+        result = self.results[key] = (flags, neworder)
+        if len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+        return result
+
+def positions_to_neworder(positions):
+    neworder = [0] * len(positions)
+    for position, index in enumerate(positions):
+        neworder[index] = position
+    return neworder
+
+class PoseListFilterCache:
+    # Search data of the pose list for each library, keyed by library pointer. Any rename,
+    # tag edit or move bumps the revision and added or removed poses change the count,
+    # so a library is only indexed again after it actually changed
+    def __init__(self):
+        self.revision = 0
+        self.entries = {}
+
+    def touch(self):
+        self.revision += 1
+
+    def entry(self, library):
+        key = library.as_pointer()
+        entry = self.entries.get(key)
+        if entry is None or entry.revision != self.revision or entry.count != len(library.poses):
+            entry = self.entries[key] = PoseListFilterEntry(library, self.revision)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.touch()
+
+pose_list_filter_cache = PoseListFilterCache()
+
+def pose_libraries_changed():
+    # Adding, removing or moving a library can move the other libraries in memory, so caches
+    # keyed by library pointer could find another library's entries
+    pose_name_index.clear()
+    pose_list_filter_cache.clear()
+    pose_feature_index.clear()
+    pose_thumbnails.keys.clear()
+
+class PoseFeatureMatrix:
+    # Every pose of one library as rows of a (poses, columns, POSE_CHANNEL_WIDTH) array, with one
+    # column per stored (armature name, bone name). Bones a pose does not store hold the rest transform
+    chunk_size = 1024
+
+    def __init__(self, library):
+        self.columns = {}
+        self.names = []
+        self.rows = {}
+        self.count = 0
+        self.pose_count = len(library.poses)
+        decoded = []
+        for pose_item in library.poses:
+            try:
+                pose = read_pose(library, pose_item)
+            except (ValueError, KeyError, TypeError, struct.error, zlib.error):
+                continue
+            if pose is not None:
+                decoded.append((pose_item.name, pose))
+        for pose_name, pose in decoded:
+            self.add_columns(pose)
+        self.features = numpy.tile(REST_POSE_VALUES, (len(decoded), len(self.columns), 1))
+        for pose_name, pose in decoded:
+            self.put(pose_name, pose)
+
+    def add_columns(self, pose):
+        new_columns = 0
+        for armature_name, armature_pose in pose.items():
+            for bone_name in armature_pose.bone_names:
+                if (armature_name, bone_name) not in self.columns:
+                    self.columns[(armature_name, bone_name)] = len(self.columns)
+                    new_columns += 1
+        if new_columns and hasattr(self, 'features'):
+            padding = numpy.tile(REST_POSE_VALUES, (self.features.shape[0], new_columns, 1))
+            self.features = numpy.concatenate((self.features, padding), axis=1)
+
+    def armature_columns(self):
+        # (armature name, bone names, column indices) for every armature in the matrix
+        grouped = {}
+        for (armature_name, bone_name), column in self.columns.items():
+            bone_names, columns = grouped.setdefault(armature_name, ([], []))
+            bone_names.append(bone_name)
+            columns.append(column)
+        return [(armature_name, bone_names, numpy.array(columns, dtype=numpy.intp)) for armature_name, (bone_names, columns) in grouped.items()]
+
+    def column_indices(self, armature_name, bone_names):
+        return numpy.array([self.columns[(armature_name, bone_name)] for bone_name in bone_names], dtype=numpy.intp)
+
+    def put(self, name, pose):
+        self.add_columns(pose)
+        row = self.rows.get(name)
+        if row is None:
+            if self.count == self.features.shape[0]:
+                growth = numpy.tile(REST_POSE_VALUES, (max(self.count, 16), len(self.columns), 1))
+                self.features = numpy.concatenate((self.features, growth))
+            row = self.rows[name] = self.count
+            self.names.append(name)
+            self.count += 1
+        self.features[row] = REST_POSE_VALUES
+        for armature_name, armature_pose in pose.items():
+            self.features[row, self.column_indices(armature_name, armature_pose.bone_names)] = armature_pose.values
+
+    def remove(self, name):
+        row = self.rows.pop(name, None)
+        if row is None:
+            return
+        last = self.count - 1
+        if row != last:
+            self.features[row] = self.features[last]
+            self.names[row] = self.names[last]
+            self.rows[self.names[row]] = row
+        self.names.pop()
+        self.count -= 1
+
+    def nearest(self, query, weights, count, exclude=None):
+        # query: (columns, POSE_CHANNEL_WIDTH) values, weights: (columns,) per bone weights.
+        # Distance is the weighted RMS over bones of location and scale offsets and the
+        # rotation angle between quaternions, treating q and -q as the same rotation
+        active = numpy.flatnonzero(weights > 0)
+        if not len(active) or not self.count:
+            return []
+        query = query[active]
+        weights = weights[active]
+        distances = numpy.empty(self.count, dtype=numpy.float64)
+        for start in range(0, self.count, self.chunk_size):
+            features = self.features[start:min(start + self.chunk_size, self.count)][:, active]
+            offsets = features - query
+            squared = (offsets[:, :, 0:3] ** 2).sum(axis=2) + (offsets[:, :, 7:10] ** 2).sum(axis=2)
+            dot = numpy.abs(numpy.einsum('pbc,bc->pb', features[:, :, 3:7], query[:, 3:7]))
+            squared += (2.0 * numpy.arccos(numpy.clip(dot, 0.0, 1.0))) ** 2
+            distances[start:start + len(features)] = squared @ weights
+        distances = numpy.sqrt(distances / weights.sum())
+        if exclude in self.rows:
+            distances[self.rows[exclude]] = numpy.inf
+        count = min(count, self.count - (exclude in self.rows))
+        if count <= 0:
+            return []
+        closest = numpy.argpartition(distances, count - 1)[:count]
+        closest = closest[numpy.argsort(distances[closest])]
+        return [(self.names[row], float(distances[row])) for row in closest]
+
+class PoseFeatureIndex:
+    # Feature matrices keyed by library pointer, built on the first similarity search and then
+    # kept up to date by save_pose and delete_pose
+    def __init__(self):
+        self.matrices = {}
+
+    def get(self, library):
+        key = library.as_pointer()
+        matrix = self.matrices.get(key)
+        if matrix is None or matrix.pose_count != len(library.poses):
+            matrix = self.matrices[key] = PoseFeatureMatrix(library)
+        return matrix
+
+    def update(self, library, name, pose):
+        matrix = self.matrices.get(library.as_pointer())
+        if matrix is not None:
+            matrix.put(name, pose)
+            matrix.pose_count = len(library.poses)
+
+    def remove(self, library, name):
+        matrix = self.matrices.get(library.as_pointer())
+        if matrix is not None:
+            matrix.remove(name)
+            matrix.pose_count = len(library.poses)
+
+    def invalidate(self, library):
+        self.matrices.pop(library.as_pointer(), None)
+
+    def clear(self):
+        self.matrices.clear()
+
+pose_feature_index = PoseFeatureIndex()
+
+class ProfileRun:
+    # Timings of one operation: each lap adds the time since the previous lap to a phase
+    def __init__(self, profiler, operation):
+        self.profiler = profiler
+        self.operation = operation
+        self.phases = {}
+        self.counts = {}
+        self.start_time = self.last_time = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last_time
+        self.last_time = now
+
+    def resume(self):
+        # Leaves out the time spent between two chunks of a modal operation
+        self.last_time = time.perf_counter()
+
+    def count(self, **counts):
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def stop(self):
+        self.phases["total"] = time.perf_counter() - self.start_time
+        self.profiler.record(self)
+
+class NullProfileRun:
+    def lap(self, phase):
+        pass
+
+    def resume(self):
+        pass
+
+    def count(self, **counts):
+        pass
+
+    def stop(self):
+        pass
+
+NULL_PROFILE_RUN = NullProfileRun()
+
+class PoseProfiler:
+    # Opt-in per-phase timings of the pose operations, keeping the most recent runs
+    def __init__(self, history=500):
+        self.enabled = False
+        self.records = deque(maxlen=history)
+
+    def start(self, operation):
+        return ProfileRun(self, operation) if self.enabled else NULL_PROFILE_RUN
+
+    def record(self, run):
+        self.records.append({
+            "time": time.time(),
+            "operation": run.operation,
+            "phases": {phase: seconds * 1000.0 for phase, seconds in run.phases.items()},
+            "counts": dict(run.counts),
+        })
+
+    def statistics(self):
+        # {operation: {"runs": n, "phases": {phase: (p50 ms, p95 ms)}, "counts": {name: mean}}}
+        grouped = {}
+        for record in self.records:
+            group = grouped.setdefault(record["operation"], {"phases": {}, "counts": {}, "runs": 0})
+            group["runs"] += 1
+            for phase, milliseconds in record["phases"].items():
+                group["phases"].setdefault(phase, []).append(milliseconds)
+            for name, value in record["counts"].items():
+                group["counts"].setdefault(name, []).append(value)
+        for group in grouped.values():
+            group["phases"] = {
+                phase: tuple(float(value) for value in numpy.percentile(samples, (50, 95)))
+                for phase, samples in group["phases"].items()
+            }
+            group["counts"] = {name: sum(values) / len(values) for name, values in group["counts"].items()}
+        return grouped
+
+    def clear(self):
+        self.records.clear()
+
+pose_profiler = PoseProfiler()
+
+class PoseLibrary:
+    def __init__(self, context):
+        self.scene = context.scene
+        self.libraries = self.scene.pose_libraries
+        self.active_library_index = self.scene.active_pose_library_index
+
+    @property
+    def active_library(self):
+        if self.active_library_index >= 0 and self.active_library_index < len(self.libraries):
+            return self.libraries[self.active_library_index]
+        return None
+
+    def decode_pose(self, library, pose_item):
+        # Returns None when the pose has no data in its database
+        prefs = bpy.context.preferences.addons[addon_name].preferences
+        payload_key = pose_payload_key(library, pose_item)
+        if payload_key is None:
+            return None
+        key = (library.name, pose_item.name, payload_key)
+        pose = decoded_pose_cache.get(key)
+        if pose is None:
+            data = pose_item.data if library.storage == 'EMBEDDED' else read_pose_payload(library, pose_item)
+            if is_pose_reference(data):
+                pose = pose_block_store.resolve(library.id_data, data)
+            else:
+                pose = decode_pose_payload(data)
+            if is_legacy_pose_payload(data):
+                # Upgrade legacy JSON poses the first time they are loaded
+                data = encode_library_pose(library, pose, prefs)
+                write_pose_payload(library, pose_item, data)
+                key = (library.name, pose_item.name, pose_payload_hash(data))
+            decoded_pose_cache.put(key, pose, prefs.pose_cache_size * 1048576)
+        return pose
+
+    def find_pose(self, library, name):
+        index = pose_name_index.find(library, name)
+        return library.poses[index] if index >= 0 else None
+
+    def save_pose(self, operator, name):
+        pose = {}
+        context = bpy.context
+        prefs = bpy.context.preferences.addons[addon_name].preferences
+        profile = pose_profiler.start("save_pose")
+
+        # Check for active library
+        library = self.active_library
+        if not library:
+            operator.report({'WARNING'}, "No active pose library selected.")
+            return {'CANCELLED'}
+
+        # Check if there is an active armature in pose mode
+        active_obj = context.active_object
+        if active_obj and active_obj.type == 'ARMATURE' and active_obj.mode == 'POSE':
+            pose[active_obj.name] = capture_armature_pose(active_obj, get_bone_set_indices(active_obj, self.scene.pose_bone_set))
+        else:
+            armature_names = [arm_name.strip() for arm_name in prefs.armature_names.split(",") if arm_name.strip() != ""]
+
+            if not armature_names:
+                operator.report({'WARNING'}, "No default armature names specified in addon preferences.")
+                return {'CANCELLED'}
+
+            for arm_name in armature_names:
+                obj = bpy.data.objects.get(arm_name)
+                if obj and obj.type == 'ARMATURE':
+                    pose[obj.name] = capture_armature_pose(obj, get_bone_set_indices(obj, self.scene.pose_bone_set))
+
+        if not pose:
+            operator.report({'WARNING'}, "No valid armatures found to save.")
+            return {'CANCELLED'}
+        profile.lap("capture")
+
+        if prefs.sparse_pose_storage:
+            pose = {armature_name: sparse_armature_pose(armature_pose, prefs.sparse_pose_tolerance) for armature_name, armature_pose in pose.items()}
+
+        pose_payload = encode_library_pose(library, pose, prefs)
+        profile.lap("encode")
+        existing = self.find_pose(library, name)
+        if existing:
+            replaced_payload = existing.data
+            write_pose_payload(library, existing, pose_payload)
+            if library.storage == 'EMBEDDED':
+                pose_block_store.release(self.scene, replaced_payload)
+            pose_thumbnails.invalidate(library, name)
+            operator.report({'INFO'}, f"Updated pose: {name}")
+        else:
+            item = library.poses.add()
+            item.name = name
+            write_pose_payload(library, item, pose_payload)
+            library.poses_index = len(library.poses) - 1
+            pose_name_index.update(library, library.poses_index)
+            operator.report({'INFO'}, f"Saved new pose: {name}")
+        pose_feature_index.update(library, name, pose)
+        profile.lap("store")
+        profile.count(armatures=len(pose), bones=sum(len(armature_pose.bone_names) for armature_pose in pose.values()))
+        profile.stop()
+
+    def target_armatures(self):
+        mode = self.scene.pose_target_mode
+        if mode == 'PATTERN':
+            pattern = self.scene.pose_target_pattern
+            return [obj for obj in self.scene.objects if obj.type == 'ARMATURE' and fnmatchcase(obj.name, pattern)]
+        if mode == 'COLLECTION':
+            collection = self.scene.pose_target_collection
+            return [obj for obj in collection.all_objects if obj.type == 'ARMATURE'] if collection else []
+        if mode == 'SELECTED':
+            return [obj for obj in bpy.context.selected_objects if obj.type == 'ARMATURE']
+        return None
+
+    def pose_targets(self, pose, saved_armatures_only=False):
+        targets = None if saved_armatures_only else self.target_armatures()
+        if targets is None:
+            for armature_name, armature_pose in pose.items():
+                obj = bpy.data.objects.get(armature_name)
+                if obj and obj.type == 'ARMATURE':
+                    yield obj, armature_pose
+            return
+
+        # Crowd targets take the stored armature with the same name, then the one whose
+        # name matches without the ".001" style suffix, then the only armature of the pose
+        base_names = {re.sub(r"\.\d+$", "", armature_name): armature_pose for armature_name, armature_pose in pose.items()}
+        single_pose = next(iter(pose.values())) if len(pose) == 1 else None
+        for obj in targets:
+            armature_pose = pose.get(obj.name) or base_names.get(re.sub(r"\.\d+$", "", obj.name)) or single_pose
+            if armature_pose is not None:
+                yield obj, armature_pose
+
+    def load_pose(self, operator, name, keyframe_frames=None, mirror=False):
+        library = self.active_library
+        if not library:
+            operator.report({'WARNING'}, "No active pose library selected.")
+            return {'CANCELLED'}
+
+        profile = pose_profiler.start("load_pose")
+        pose_item = self.find_pose(library, name)
+        profile.lap("lookup")
+        if pose_item:
+            prefs = bpy.context.preferences.addons[addon_name].preferences
+            reset_unsaved_bones = prefs.reset_unsaved_bones
+
+            pose = self.decode_pose(library, pose_item)
+            if pose is None:
+                operator.report({'WARNING'}, f"Pose '{name}' has no data in the pose database.")
+                return {'CANCELLED'}
+            profile.lap("decode")
+
+            missing_bones = 0
+            loaded_armatures = 0
+            start_time = time.perf_counter()
+            for obj, armature_pose in self.pose_targets(pose):
+                mapping = get_bone_mapping(obj, armature_pose)
+                bone_indices = get_bone_set_indices(obj, self.scene.pose_bone_set)
+                profile.lap("match")
+                if mirror:
+                    pose_values = mapping.mirrored_pose_values(obj, armature_pose.values, reset_unsaved_bones, get_bone_symmetry(obj))
+                    if bone_indices is not None:
+                        pose_values = pose_values[bone_indices]
+                    profile.lap("mirror")
+                elif bone_indices is not None:
+                    pose_values = mapping.masked_pose_values(obj, armature_pose.values, reset_unsaved_bones, bone_indices)
+                else:
+                    pose_values = mapping.pose_values(obj, armature_pose.values, reset_unsaved_bones)
+                if bone_indices is not None:
+                    apply_masked_pose_values(obj, bone_indices, pose_values)
+                else:
+                    apply_pose_values(obj, pose_values)
+                profile.lap("write")
+                if keyframe_frames:
+                    keyframe_pose_values(obj, pose_values, keyframe_frames, bone_indices)
+                    profile.lap("keyframes")
+                missing_bones += mapping.missing
+                loaded_armatures += 1
+                profile.count(bones=mapping.bone_count if bone_indices is None else len(bone_indices))
+            bpy.context.view_layer.update()
+            elapsed = time.perf_counter() - start_time
+            profile.lap("update")
+            profile.count(armatures=loaded_armatures)
+            profile.stop()
+
+            message = f"Loaded mirrored pose: {name}" if mirror else f"Loaded pose: {name}"
+            if self.scene.pose_target_mode != 'NAME':
+                message += f" on {loaded_armatures} armatures ({loaded_armatures / max(elapsed, 1e-6):.0f} armatures/s)"
+            if missing_bones:
+                operator.report({'WARNING'}, f"{message} ({missing_bones} saved bones not found in the armatures)")
+            else:
+                operator.report({'INFO'}, message)
+        else:
+            operator.report({'WARNING'}, f"Pose '{name}' not found in the active library.")
+
+    def key_pose(self, operator, name, frames):
+        library = self.active_library
+        if not library:
+            operator.report({'WARNING'}, "No active pose library selected.")
+            return {'CANCELLED'}
+
+        pose_item = self.find_pose(library, name)
+        if not pose_item:
+            operator.report({'WARNING'}, f"Pose '{name}' not found in the active library.")
+            return {'CANCELLED'}
+
+        prefs = bpy.context.preferences.addons[addon_name].preferences
+        profile = pose_profiler.start("key_pose")
+        pose = self.decode_pose(library, pose_item)
+        if pose is None:
+            operator.report({'WARNING'}, f"Pose '{name}' has no data in the pose database.")
+            return {'CANCELLED'}
+        profile.lap("decode")
+        keyed_armatures = 0
+        for obj, armature_pose in self.pose_targets(pose):
+            mapping = get_bone_mapping(obj, armature_pose)
+            bone_indices = get_bone_set_indices(obj, self.scene.pose_bone_set)
+            profile.lap("match")
+            if bone_indices is not None:
+                pose_values = mapping.masked_pose_values(obj, armature_pose.values, prefs.reset_unsaved_bones, bone_indices)
+            else:
+                pose_values = mapping.pose_values(obj, armature_pose.values, prefs.reset_unsaved_bones)
+            keyframe_pose_values(obj, pose_values, frames, bone_indices)
+            profile.lap("keyframes")
+            keyed_armatures += 1
+            profile.count(bones=mapping.bone_count if bone_indices is None else len(bone_indices))
+        bpy.context.view_layer.update()
+        profile.lap("update")
+        profile.count(armatures=keyed_armatures, frames=len(set(frames)))
+        profile.stop()
+        operator.report({'INFO'}, f"Keyed pose '{name}' on {len(set(frames))} frames for {keyed_armatures} armatures")
+
+    def delete_pose(self, operator, name):
+        library = self.active_library
+        if not library:
+            operator.report({'WARNING'}, "No active pose library selected.")
+            return
+
+        profile = pose_profiler.start("delete_pose")
+        index = pose_name_index.find(library, name)
+        profile.lap("lookup")
+        if index >= 0:
+            if library.storage == 'DATABASE':
+                get_pose_store(library).delete_pose(library.database_library, name)
+            else:
+                pose_block_store.release(self.scene, library.poses[index].data)
+            library.poses.remove(index)
+            pose_name_index.invalidate(library)
+            pose_feature_index.remove(library, name)
+            profile.lap("remove")
+            profile.stop()
+            operator.report({'INFO'}, f"Deleted pose: {name}")
+            return
+        operator.report({'WARNING'}, f"Pose '{name}' not found in the active library.")
+
+    def similarity_query(self, matrix, pose, selected_bones_only):
+        # Query values and per column weights. With pose=None the query is the current state of
+        # the saved armatures. Bones are weighted by their "similarity_weight" custom property
+        query = numpy.tile(REST_POSE_VALUES, (len(matrix.columns), 1))
+        weights = numpy.zeros(len(matrix.columns), dtype=numpy.float32)
+        for armature_name, bone_names, columns in matrix.armature_columns():
+            obj = bpy.data.objects.get(armature_name)
+            if obj is not None and obj.type != 'ARMATURE':
+                obj = None
+            if pose is not None:
+                armature_pose = pose.get(armature_name)
+                if armature_pose is None:
+                    continue
+                query[matrix.column_indices(armature_name, armature_pose.bone_names)] = armature_pose.values
+                weights[columns] = 1.0
+            elif obj is not None:
+                armature_pose = capture_armature_pose(obj)
+                stored = [index for index, bone_name in enumerate(armature_pose.bone_names) if (armature_name, bone_name) in matrix.columns]
+                query[matrix.column_indices(armature_name, [armature_pose.bone_names[index] for index in stored])] = armature_pose.values[stored]
+                weights[columns] = [1.0 if bone_name in obj.pose.bones else 0.0 for bone_name in bone_names]
+            else:
+                continue
+
+            if obj is not None:
+                for column, bone_name in zip(columns, bone_names):
+                    pose_bone = obj.pose.bones.get(bone_name)
+                    if pose_bone is None:
+                        if selected_bones_only:
+                            weights[column] = 0.0
+                        continue
+                    weights[column] *= float(pose_bone.get("similarity_weight", 1.0))
+                    if selected_bones_only and not pose_bone.bone.select:
+                        weights[column] = 0.0
+        return query, weights
+
+    def find_similar_poses(self, operator, source, count, selected_bones_only=False):
+        # Returns (pose name, distance) pairs, closest first, or None when there is nothing to compare
+        library = self.active_library
+        if not library:
+            operator.report({'WARNING'}, "No active pose library selected.")
+            return None
+        upgrade_library(library, bpy.context.preferences.addons[addon_name].preferences)
+
+        pose = None
+        exclude = None
+        if source == 'POSE':
+            if not 0 <= library.poses_index < len(library.poses):
+                operator.report({'WARNING'}, "No pose selected.")
+                return None
+            pose_item = library.poses[library.poses_index]
+            pose = self.decode_pose(library, pose_item)
+            if pose is None:
+                operator.report({'WARNING'}, f"Pose '{pose_item.name}' has no data in the pose database.")
+                return None
+            exclude = pose_item.name
+
+        profile = pose_profiler.start("find_similar")
+        for attempt in range(2):
+            matrix = pose_feature_index.get(library)
+            profile.lap("index")
+            query, weights = self.similarity_query(matrix, pose, selected_bones_only)
+            profile.lap("query")
+            results = matrix.nearest(query, weights, count, exclude)
+            profile.lap("search")
+            # Renamed poses are only noticed here, the matrix is built again once
+            if all(pose_name_index.find(library, pose_name) >= 0 for pose_name, distance in results):
+                break
+            pose_feature_index.invalidate(library)
+
+        if not weights.any():
+            operator.report({'WARNING'}, "None of the armatures in this library are in the scene, or no bones are selected.")
+            return None
+        profile.count(poses=matrix.count, bones=int(numpy.count_nonzero(weights)))
+        profile.stop()
+        return results
+
+def find_view3d_area():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                for region in area.regions:
+                    if region.type == 'WINDOW':
+                        return area, region
+    return None, None
+
+class PoseThumbnails:
+    # Pose previews rendered offscreen by a timer, one per tick, and cached on disk by a hash
+    # of the pose content and the camera settings
+    def __init__(self):
+        self.previews = None
+        self.keys = {}
+        self.queue = OrderedDict()
+        self.failed = {}
+        self.timer_running = False
+
+    def register(self):
+        self.previews = bpy.utils.previews.new()
+
+    def unregister(self):
+        if self.timer_running and bpy.app.timers.is_registered(self.process_queue):
+            bpy.app.timers.unregister(self.process_queue)
+        self.timer_running = False
+        self.queue.clear()
+        self.keys.clear()
+        self.failed.clear()
+        bpy.utils.previews.remove(self.previews)
+        self.previews = None
+
+    def directory(self):
+        prefs = bpy.context.preferences.addons[addon_name].preferences
+        if prefs.thumbnail_directory:
+            directory = bpy.path.abspath(prefs.thumbnail_directory)
+            os.makedirs(directory, exist_ok=True)
+            return directory
+        return bpy.utils.user_resource('DATAFILES', path="amarillo_pose_thumbnails", create=True)
+
+    def camera_signature(self, scene):
+        camera = scene.camera
+        if camera is None or camera.type != 'CAMERA':
+            return None
+        size = bpy.context.preferences.addons[addon_name].preferences.thumbnail_size
+        camera_data = camera.data
+        matrix = tuple(round(value, 4) for row in camera.matrix_world for value in row)
+        settings = (camera_data.type, camera_data.lens, camera_data.ortho_scale, camera_data.sensor_width,
+                    camera_data.shift_x, camera_data.shift_y, camera_data.clip_start, camera_data.clip_end)
+        return repr((matrix, settings, size))
+
+    def thumbnail_key(self, library, pose_item, signature):
+        # Hash of the decoded content rather than the payload, so upgrading, deduplicating or
+        # recompressing a pose keeps its thumbnail. None when a database pose has no data
+        if library.storage == 'EMBEDDED' and is_pose_reference(pose_item.data):
+            content_hashes = dict(pose_reference_hashes(pose_item.data))
+        else:
+            pose = read_pose(library, pose_item)
+            if pose is None:
+                return None
+            content_hashes = pose_content_hashes(pose)
+        content_key = json.dumps(content_hashes, sort_keys=True)
+        return hashlib.blake2b(f"{content_key}|{signature}".encode('utf-8'), digest_size=16).hexdigest()
+
+    def icon_id(self, scene, library, pose_item):
+        # Returns 0 while the thumbnail is not available yet. Memos are keyed by library pointer
+        # since several libraries can share a name
+        signature = self.camera_signature(scene)
+        if signature is None or self.previews is None:
+            return 0
+
+        memo_key = (library.as_pointer(), pose_item.name)
+        memo = self.keys.get(memo_key)
+        if memo is not None and memo[0] == signature:
+            key = memo[1]
+        else:
+            key = self.thumbnail_key(library, pose_item, signature)
+            if key is None:
+                return 0
+            self.keys[memo_key] = (signature, key)
+
+        preview = self.previews.get(key)
+        if preview is not None:
+            return preview.icon_id
+        filepath = os.path.join(self.directory(), f"{key}.png")
+        if os.path.exists(filepath):
+            return self.previews.load(key, filepath, 'IMAGE').icon_id
+        if not bpy.app.background and key not in self.queue and key not in self.failed:
+            self.queue[key] = (library.as_pointer(), pose_item.name, filepath)
+            if not self.timer_running:
+                self.timer_running = True
+                bpy.app.timers.register(self.process_queue, first_interval=0.1)
+        return 0
+
+    def invalidate(self, library, pose_name):
+        self.keys.pop((library.as_pointer(), pose_name), None)
+
+    def process_queue(self):
+        if not self.queue:
+            self.timer_running = False
+            return None
+        key, (library_pointer, pose_name, filepath) = self.queue.popitem(last=False)
+        finished = False
+        try:
+            self.render(key, library_pointer, pose_name, filepath)
+            finished = True
+        except (RuntimeError, OSError, ValueError, KeyError, TypeError, struct.error, zlib.error) as error:
+            # Not queued again, the panel reports it
+            self.failed[key] = f"'{pose_name}': {error}"
+            finished = True
+        finally:
+            # An unexpected error ends the timer, the next thumbnail drawn starts it again
+            if not finished:
+                self.timer_running = False
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'VIEW_3D':
+                    area.tag_redraw()
+        return 0.05
+
+    def render(self, key, library_pointer, pose_name, filepath):
+        context = bpy.context
+        scene = context.scene
+        area, region = find_view3d_area()
+        library = next((library for library in scene.pose_libraries if library.as_pointer() == library_pointer), None)
+        pose_item = library.poses.get(pose_name) if library else None
+        if area is None or pose_item is None or scene.camera is None:
+            return
+        # The library may have been reallocated or the pose changed since it was queued
+        if self.thumbnail_key(library, pose_item, self.camera_signature(scene)) != key:
+            return
+
+        pose_library = PoseLibrary(context)
+        pose = pose_library.decode_pose(library, pose_item)
+        if pose is None:
+            return
+        prefs = context.preferences.addons[addon_name].preferences
+        size = prefs.thumbnail_size
+        targets = list(pose_library.pose_targets(pose, saved_armatures_only=True))
+        original_values = [(obj, capture_pose_values(obj)) for obj, armature_pose in targets]
+        offscreen = gpu.types.GPUOffScreen(size, size)
+        try:
+            for obj, armature_pose in targets:
+                mapping = get_bone_mapping(obj, armature_pose)
+                apply_pose_values(obj, mapping.pose_values(obj, armature_pose.values, prefs.reset_unsaved_bones))
+            context.view_layer.update()
+
+            depsgraph = context.evaluated_depsgraph_get()
+            view_matrix = scene.camera.matrix_world.inverted()
+            projection_matrix = scene.camera.calc_matrix_camera(depsgraph, x=size, y=size)
+            offscreen.draw_view3d(scene, context.view_layer, area.spaces.active, region, view_matrix, projection_matrix, do_color_management=True)
+            with offscreen.bind():
+                buffer = gpu.state.active_framebuffer_get().read_color(0, 0, size, size, 4, 0, 'FLOAT')
+            buffer.dimensions = size * size * 4
+            pixels = numpy.array(buffer, dtype=numpy.float32)
+        finally:
+            offscreen.free()
+            for obj, values in original_values:
+                apply_pose_values(obj, values)
+            context.view_layer.update()
+
+        image = bpy.data.images.new(".pose_thumbnail", size, size, alpha=True)
+        try:
+            image.pixels.foreach_set(pixels)
+            image.filepath_raw = filepath
+            image.file_format = 'PNG'
+            image.save()
+        finally:
+            bpy.data.images.remove(image)
+        if key not in self.previews:
+            self.previews.load(key, filepath, 'IMAGE')
+
+pose_thumbnails = PoseThumbnails()
+
+class PoseLibraryUIList(bpy.types.UIList):
+    bl_idname = "AMARILLO_UL_pose_library"
+
+    filter_tags: bpy.props.StringProperty(name="Tags", description="Only show poses with all of these comma separated tags")
+    use_fuzzy_search: bpy.props.BoolProperty(name="Fuzzy", description="Match the letters of the search in order, anywhere in the pose name", default=False)
+    sort_order: bpy.props.EnumProperty(
+        name="Sort",
+        items=(
+            ('INDEX', 'Library Order', "Keep the order of the library"),
+            ('NAME', 'Name', "Sort by name, numbers in natural order"),
+            ('TAGS', 'Tags', "Group poses by their tags"),
+            ('RELEVANCE', 'Best Match', "Closest fuzzy search matches first"),
+        ),
+        default='INDEX'
+    )
+
+    def draw_filter(self, context, layout):
+        row = layout.row(align=True)
+        row.prop(self, "filter_name", text="", icon='VIEWZOOM')
+        row.prop(self, "use_fuzzy_search", text="", icon='SORTBYEXT')
+        row.prop(self, "use_filter_invert", text="", icon='ARROW_LEFTRIGHT')
+        row = layout.row(align=True)
+        row.prop(self, "filter_tags", text="", icon='BOOKMARKS')
+        row.prop(self, "sort_order", text="")
+        row.prop(self, "use_filter_sort_reverse", text="", icon='SORT_DESC' if self.use_filter_sort_reverse else 'SORT_ASC')
+
+    def filter_items(self, context, data, propname):
+        entry = pose_list_filter_cache.entry(data)
+        flags, neworder = entry.filter(self.filter_name, self.filter_tags, self.use_fuzzy_search, self.sort_order, self.bitflag_filter_item)
+        return flags, neworder
+
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        pose = item
+        if self.layout_type in {'DEFAULT', 'COMPACT'}:
+            row = layout.row(align=True)
+            row.label(text=pose.name)
+            load_op = row.operator("amarillo_pose.load_direct", text="", icon='MOD_MIRROR', emboss=False)
+            load_op.pose_name = pose.name
+            load_op.mirror = True
+            load_op = row.operator("amarillo_pose.load_direct", text="", icon='IMPORT', emboss=False)
+            load_op.pose_name = pose.name
+        elif self.layout_type in {'GRID'}:
+            layout.alignment = 'CENTER'
+            icon_id = pose_thumbnails.icon_id(context.scene, data, pose)
+            if icon_id:
+                layout.template_icon(icon_value=icon_id, scale=4.0)
+            else:
+                layout.label(text="", icon='ARMATURE_DATA')
+            layout.label(text=pose.name)
+
+class PoseLibrariesUIList(bpy.types.UIList):
+    bl_idname = "AMARILLO_UL_pose_libraries"
+
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        library = item
+        if self.layout_type in {'DEFAULT', 'COMPACT'}:
+            layout.label(text=library.name, icon='FILE_FOLDER')
+        elif self.layout_type in {'GRID'}:
+            layout.alignment = 'CENTER'
+            layout.label(text="", icon='FILE_FOLDER')
+
+class PoseLibraryPanel(bpy.types.Panel):
+    bl_label = "Amarillo's Pose Library"
+    bl_idname = "AMARILLO_PT_pose_library"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'Amarillo'
+
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+
+        col = layout.column()
+        if scene.pose_library_schema_version < SCENE_SCHEMA_VERSION and len(getattr(scene, 'expression_library', ())):
+            col.operator("amarillo_pose.upgrade_libraries", text="Upgrade Poses from Older Version", icon='FILE_REFRESH')
+        row = col.row()
+        row.template_list("AMARILLO_UL_pose_libraries", "", scene, "pose_libraries", scene, "active_pose_library_index")
+
+        lib_ops = row.column(align=True)
+        lib_ops.operator("amarillo_pose.add_library", icon='ADD', text="")
+        lib_ops.operator("amarillo_pose.remove_library", icon='REMOVE', text="")
+
+        lib_ops.separator()
+        lib_ops.operator("amarillo_pose.rename_library", icon='OUTLINER_DATA_FONT', text="")
+
+        col.separator()
+        col.operator("amarillo_pose.export_library", text="Export Library")
+        col.operator("amarillo_pose.export_library", text="Export All Libraries").export_all = True
+        col.operator("amarillo_pose.import_library", text="Import Library")
+
+        library = None
+        if scene.active_pose_library_index >= 0 and scene.active_pose_library_index < len(scene.pose_libraries):
+            library = scene.pose_libraries[scene.active_pose_library_index]
+
+        if library:
+            if library.storage == 'DATABASE':
+                box = col.box()
+                box.label(text=f"Database: {bpy.path.basename(library.database_path)}", icon='LINKED')
+                row = box.row(align=True)
+                row.operator("amarillo_pose.sync_database", text="Refresh", icon='FILE_REFRESH')
+                row.operator("amarillo_pose.embed_library", text="Embed")
+            else:
+                col.operator("amarillo_pose.link_database", text="Store in Database")
+
+            col.separator()
+            col.operator("amarillo_pose.save", text="Save Pose")
+
+            if library.poses:
+                col.row().prop(scene, "pose_library_view", expand=True)
+                if scene.pose_library_view == 'GRID' and not scene.camera:
+                    col.label(text="Set a scene camera to render thumbnails.", icon='INFO')
+                if scene.pose_library_view == 'GRID' and pose_thumbnails.failed:
+                    failed = pose_thumbnails.failed
+                    col.label(text=f"{len(failed)} thumbnails could not be rendered, last {next(reversed(failed.values()))}", icon='ERROR')
+                row = col.row()
+                list_type = 'GRID' if scene.pose_library_view == 'GRID' else 'DEFAULT'
+                row.template_list("AMARILLO_UL_pose_library", "", library, "poses", library, "poses_index", type=list_type, columns=3)
+
+                pose_ops = row.column(align=True)
+                pose_ops.operator("amarillo_pose.move_pose", icon='TRIA_UP', text="").direction = 'UP'
+                pose_ops.operator("amarillo_pose.move_pose", icon='TRIA_DOWN', text="").direction = 'DOWN'
+
+                pose_ops.separator()
+                pose_ops.operator("amarillo_pose.delete", icon='REMOVE', text="")
+
+                if 0 <= library.poses_index < len(library.poses):
+                    col.prop(library.poses[library.poses_index], "tags", icon='BOOKMARKS')
+
+                col.prop(scene, "pose_target_mode", text="Targets")
+                if scene.pose_target_mode == 'PATTERN':
+                    col.prop(scene, "pose_target_pattern", text="")
+                elif scene.pose_target_mode == 'COLLECTION':
+                    col.prop(scene, "pose_target_collection", text="")
+
+                row = col.row(align=True)
+                row.operator("amarillo_pose.load", text="Load Selected Pose")
+                row.operator("amarillo_pose.load", text="Mirrored").mirror = True
+                row.operator("amarillo_pose.blend", text="Blend")
+                row = col.row(align=True)
+                row.operator("amarillo_pose.load", text="Load and Key").insert_keyframes = True
+                row.operator("amarillo_pose.key_frames", text="Key on Frames")
+            else:
+                col.label(text="No poses in this library.")
+        else:
+            col.label(text="No pose library selected.")
+
+class PoseLibraryBoneSetsPanel(bpy.types.Panel):
+    bl_label = "Bone Sets"
+    bl_idname = "AMARILLO_PT_pose_library_bone_sets"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'Amarillo'
+    bl_parent_id = "AMARILLO_PT_pose_library"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+        obj = context.active_object
+        if obj and obj.type == 'ARMATURE':
+            layout.prop_search(scene, "pose_bone_set", obj, "pose_bone_sets", text="Only")
+            col = layout.column(align=True)
+            for bone_set in obj.pose_bone_sets:
+                row = col.row(align=True)
+                row.label(text=f"{bone_set.name} ({len(bone_set.bones)} bones)", icon='GROUP_BONE')
+                row.operator("amarillo_pose.remove_bone_set", text="", icon='X', emboss=False).set_name = bone_set.name
+        else:
+            layout.prop(scene, "pose_bone_set", text="Only")
+        layout.operator("amarillo_pose.add_bone_set", text="New Bone Set", icon='ADD')
+
+class AddBoneSetOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.add_bone_set"
+    bl_label = "New Bone Set"
+    bl_description = "Save the selected bones, or the bones matching a pattern, as a named bone set of their armature"
+    bl_options = {'UNDO'}
+
+    set_name: bpy.props.StringProperty(name="Name", default="Bone Set")
+    pattern: bpy.props.StringProperty(name="Bones", description="Comma separated bone name patterns like 'lip*, jaw'. Leave empty to use the selected bones")
+
+    def execute(self, context):
+        bone_sets = {}
+        if self.pattern.strip():
+            patterns = [pattern.strip() for pattern in self.pattern.split(",") if pattern.strip()]
+            armatures = [obj for obj in context.selected_objects if obj.type == 'ARMATURE']
+            if context.active_object and context.active_object.type == 'ARMATURE' and context.active_object not in armatures:
+                armatures.append(context.active_object)
+            for obj in armatures:
+                bone_names = [bone_name for bone_name in obj.pose.bones.keys() if any(fnmatchcase(bone_name, pattern) for pattern in patterns)]
+                if bone_names:
+                    bone_sets[obj] = bone_names
+        else:
+            for pose_bone in context.selected_pose_bones or ():
+                bone_sets.setdefault(pose_bone.id_data, []).append(pose_bone.name)
+
+        if not bone_sets:
+            self.report({'WARNING'}, "No bones selected or matching the pattern.")
+            return {'CANCELLED'}
+
+        for obj, bone_names in bone_sets.items():
+            bone_set = obj.pose_bone_sets.get(self.set_name)
+            if bone_set is None:
+                bone_set = obj.pose_bone_sets.add()
+                bone_set.name = self.set_name
+            bone_set.bones.clear()
+            for bone_name in bone_names:
+                bone_set.bones.add().name = bone_name
+        context.scene.pose_bone_set = self.set_name
+        self.report({'INFO'}, f"Bone set '{self.set_name}' saved for {len(bone_sets)} armatures.")
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+class RemoveBoneSetOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.remove_bone_set"
+    bl_label = "Remove Bone Set"
+    bl_options = {'UNDO'}
+
+    set_name: bpy.props.StringProperty()
+
+    def execute(self, context):
+        obj = context.active_object
+        index = obj.pose_bone_sets.find(self.set_name) if obj and obj.type == 'ARMATURE' else -1
+        if index < 0:
+            self.report({'WARNING'}, f"Bone set '{self.set_name}' not found on the active armature.")
+            return {'CANCELLED'}
+        obj.pose_bone_sets.remove(index)
+        if context.scene.pose_bone_set == self.set_name:
+            context.scene.pose_bone_set = ""
+        return {'FINISHED'}
+
+class PoseLibrarySimilarPanel(bpy.types.Panel):
+    bl_label = "Similar Poses"
+    bl_idname = "AMARILLO_PT_pose_library_similar"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'Amarillo'
+    bl_parent_id = "AMARILLO_PT_pose_library"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        window_manager = context.window_manager
+        library = PoseLibrary(context).active_library
+        if not library or not library.poses:
+            layout.label(text="No poses in this library.")
+            return
+
+        row = layout.row(align=True)
+        row.operator("amarillo_pose.find_similar", text="From Current Pose").source = 'CURRENT'
+        row.operator("amarillo_pose.find_similar", text="From Selected Pose").source = 'POSE'
+
+        if window_manager.pose_similarity_library != library.name:
+            return
+        col = layout.column(align=True)
+        for result in window_manager.pose_similarity_results:
+            row = col.row(align=True)
+            row.label(text=result.name)
+            row.label(text=f"{result.distance:.4f}")
+            load_op = row.operator("amarillo_pose.load_direct", text="", icon='IMPORT', emboss=False)
+            load_op.pose_name = result.name
+
+class FindSimilarPosesOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.find_similar"
+    bl_label = "Find Similar Poses"
+    bl_description = "List the poses of the active library closest to the current pose or to the selected pose"
+    bl_options = {'REGISTER'}
+
+    source: bpy.props.EnumProperty(
+        name="Compare",
+        items=(
+            ('CURRENT', 'Current Pose', "Compare the library with the current pose of the saved armatures"),
+            ('POSE', 'Selected Pose', "Compare the library with the selected library pose"),
+        ),
+        default='CURRENT'
+    )
+    count: bpy.props.IntProperty(name="Results", default=10, min=1, max=200)
+    selected_bones_only: bpy.props.BoolProperty(name="Selected Bones Only", description="Only compare the selected bones", default=False)
+
+    def execute(self, context):
+        pose_library = PoseLibrary(context)
+        results = pose_library.find_similar_poses(self, self.source, self.count, self.selected_bones_only)
+        if results is None:
+            return {'CANCELLED'}
+
+        window_manager = context.window_manager
+        window_manager.pose_similarity_results.clear()
+        for pose_name, distance in results:
+            result = window_manager.pose_similarity_results.add()
+            result.name = pose_name
+            result.distance = distance
+        window_manager.pose_similarity_library = pose_library.active_library.name
+        self.report({'INFO'}, f"Found {len(results)} similar poses.")
+        return {'FINISHED'}
+
+class PoseLibraryStatsPanel(bpy.types.Panel):
+    bl_label = "Performance"
+    bl_idname = "AMARILLO_PT_pose_library_stats"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'Amarillo'
+    bl_parent_id = "AMARILLO_PT_pose_library"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(context.window_manager, "pose_library_profiling")
+
+        statistics = pose_profiler.statistics()
+        if not statistics:
+            layout.label(text="No timings recorded yet.")
+            return
+
+        for operation, group in statistics.items():
+            box = layout.box()
+            counts = ", ".join(f"{value:.0f} {name}" for name, value in group["counts"].items())
+            box.label(text=f"{operation} ({group['runs']} runs{', ' + counts if counts else ''})")
+            grid = box.grid_flow(columns=3, even_columns=True, align=True)
+            for phase, (median, slowest) in group["phases"].items():
+                grid.label(text=phase)
+                grid.label(text=f"p50 {median:.2f} ms")
+                grid.label(text=f"p95 {slowest:.2f} ms")
+
+        row = layout.row(align=True)
+        row.operator("amarillo_pose.export_stats", text="Export", icon='EXPORT')
+        row.operator("amarillo_pose.reset_stats", text="Reset", icon='X')
+
+class ExportPoseStatsOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.export_stats"
+    bl_label = "Export Pose Library Timings"
+
+    filepath: bpy.props.StringProperty(subtype="FILE_PATH")
+
+    def execute(self, context):
+        records = list(pose_profiler.records)
+        if self.filepath.lower().endswith(".csv"):
+            count_names = sorted({name for record in records for name in record["counts"]})
+            with open(self.filepath, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(["time", "operation", "phase", "milliseconds"] + count_names)
+                for record in records:
+                    counts = [record["counts"].get(name, "") for name in count_names]
+                    for phase, milliseconds in record["phases"].items():
+                        writer.writerow([record["time"], record["operation"], phase, milliseconds] + counts)
+        else:
+            export_data = {
+                "summary": {
+                    operation: {
+                        "runs": group["runs"],
+                        "counts": group["counts"],
+                        "phases": {phase: {"p50_ms": median, "p95_ms": slowest} for phase, (median, slowest) in group["phases"].items()},
+                    }
+                    for operation, group in pose_profiler.statistics().items()
+                },
+                "records": records,
+            }
+            with open(self.filepath, 'w', encoding='utf-8') as file:
+                json.dump(export_data, file, indent=4)
+        self.report({'INFO'}, f"Exported {len(records)} timing records.")
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        if not self.filepath:
+            self.filepath = "pose_library_timings.json"
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+class ResetPoseStatsOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.reset_stats"
+    bl_label = "Reset Pose Library Timings"
+
+    def execute(self, context):
+        pose_profiler.clear()
+        return {'FINISHED'}
+
+class AddPoseLibraryOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.add_library"
+    bl_label = "Add Pose Library"
+
+    library_name: bpy.props.StringProperty(name="Library Name", default="New Library")
+
+    def execute(self, context):
+        scene = context.scene
+        new_lib = scene.pose_libraries.add()
+        new_lib.name = self.library_name
+        new_lib.schema_version = LIBRARY_SCHEMA_VERSION
+        pose_libraries_changed()
+        scene.active_pose_library_index = len(scene.pose_libraries) - 1
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        self.library_name = "New Library"
+        return context.window_manager.invoke_props_dialog(self)
+
+class RemovePoseLibraryOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.remove_library"
+    bl_label = "Remove Pose Library"
+    bl_options = {'UNDO'}
+
+    def execute(self, context):
+        scene = context.scene
+        index = scene.active_pose_library_index
+        if index >= 0 and index < len(scene.pose_libraries):
+            library = scene.pose_libraries[index]
+            pose_name_index.invalidate(library)
+            if library.storage == 'EMBEDDED':
+                pose_block_store.release(scene, *(pose.data for pose in library.poses))
+            scene.pose_libraries.remove(index)
+            pose_libraries_changed()
+            scene.active_pose_library_index = min(index, len(scene.pose_libraries) - 1)
+            if index == 0:
+                # An unfinished copy of the old poses starts over in a new library
+                scene.pose_library_upgrade_position = 0
+            self.report({'INFO'}, "Pose library deleted.")
+            return {'FINISHED'}
+        else:
+            self.report({'WARNING'}, "No pose library selected.")
+            return {'CANCELLED'}
+
+    def invoke(self, context, event):
+        scene = context.scene
+        index = scene.active_pose_library_index
+        if index >= 0 and index < len(scene.pose_libraries):
+            return context.window_manager.invoke_props_dialog(self)
+        else:
+            self.report({'WARNING'}, "No pose library selected.")
+            return {'CANCELLED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+        index = scene.active_pose_library_index
+        library_name = scene.pose_libraries[index].name
+        layout.label(text=f"Remove Pose Library '{library_name}'?")
+        layout.label(text="This will make you lose all the poses in it.")
+
+class RenamePoseLibraryOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.rename_library"
+    bl_label = "Rename Pose Library"
+
+    new_name: bpy.props.StringProperty(name="New Name")
+
+    def execute(self, context):
+        scene = context.scene
+        index = scene.active_pose_library_index
+        if index >= 0 and index < len(scene.pose_libraries):
+            scene.pose_libraries[index].name = self.new_name
+            return {'FINISHED'}
+        else:
+            self.report({'WARNING'}, "No pose library selected.")
+            return {'CANCELLED'}
+
+    def invoke(self, context, event):
+        scene = context.scene
+        index = scene.active_pose_library_index
+        if index >= 0 and index < len(scene.pose_libraries):
+            self.new_name = scene.pose_libraries[index].name
+            return context.window_manager.invoke_props_dialog(self)
+        else:
+            self.report({'WARNING'}, "No pose library selected.")
+            return {'CANCELLED'}
+
+class SavePoseOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.save"
+    bl_label = "Save Pose"
+
+    pose_name: bpy.props.StringProperty(name="Pose Name")
+
+    def execute(self, context):
+        if not self.pose_name.strip():
+            self.report({'WARNING'}, "Pose name cannot be empty")
+            return {'CANCELLED'}
+
+        library = PoseLibrary(context)
+        result = library.save_pose(self, self.pose_name.strip())
+        return result if result else {'FINISHED'}
+
+    def invoke(self, context, event):
+        library = PoseLibrary(context)
+        active_lib = library.active_library
+        if active_lib:
+            index = active_lib.poses_index
+            if index >= 0 and index < len(active_lib.poses):
+                self.pose_name = active_lib.poses[index].name
+            else:
+                self.pose_name = ""
+            return context.window_manager.invoke_props_dialog(self)
+        else:
+            self.report({'WARNING'}, "No pose library selected.")
+            return {'CANCELLED'}
+
+class LoadPoseOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.load"
+    bl_label = "Load Pose"
+
+    insert_keyframes: bpy.props.BoolProperty(name="Insert Keyframes", description="Key every bone of the loaded armatures at the current frame", default=False)
+    mirror: bpy.props.BoolProperty(name="Mirror", description="Load the pose flipped to the other side of the rig", default=False)
+
+    def execute(self, context):
+        library = PoseLibrary(context)
+        active_lib = library.active_library
+        if active_lib:
+            index = active_lib.poses_index
+            if index >= 0 and index < len(active_lib.poses):
+                pose_name = active_lib.poses[index].name
+                keyframe_frames = [context.scene.frame_current] if self.insert_keyframes else None
+                library.load_pose(self, pose_name, keyframe_frames, self.mirror)
+                return {'FINISHED'}
+            else:
+                self.report({'WARNING'}, "No pose selected")
+                return {'CANCELLED'}
+        else:
+            self.report({'WARNING'}, "No pose library selected.")
+            return {'CANCELLED'}
+
+class BlendPoseOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.blend"
+    bl_label = "Blend Pose"
+    bl_options = {'REGISTER', 'UNDO', 'BLOCKING'}
+
+    pose_name: bpy.props.StringProperty()
+    factor: bpy.props.FloatProperty(name="Factor", default=0.0, min=0.0, max=1.0, subtype='FACTOR')
+
+    # Horizontal mouse travel, in pixels, that blends from the current pose to the library pose
+    drag_distance = 300
+    wheel_step = 0.05
+
+    def prepare(self, context):
+        library = PoseLibrary(context)
+        active_lib = library.active_library
+        if not active_lib:
+            self.report({'WARNING'}, "No pose library selected.")
+            return False
+
+        if not self.pose_name:
+            index = active_lib.poses_index
+            if index < 0 or index >= len(active_lib.poses):
+                self.report({'WARNING'}, "No pose selected")
+                return False
+            self.pose_name = active_lib.poses[index].name
+
+        pose_item = library.find_pose(active_lib, self.pose_name)
+        if not pose_item:
+            self.report({'WARNING'}, f"Pose '{self.pose_name}' not found in the active library.")
+            return False
+
+        prefs = context.preferences.addons[addon_name].preferences
+        pose = library.decode_pose(active_lib, pose_item)
+        if pose is None:
+            self.report({'WARNING'}, f"Pose '{self.pose_name}' has no data in the pose database.")
+            return False
+        # Like loading, blending only touches the bones of the active bone set
+        set_name = context.scene.pose_bone_set
+        self._blends = []
+        missing_set = []
+        for obj, armature_pose in library.pose_targets(pose):
+            mapping = get_bone_mapping(obj, armature_pose)
+            bone_indices = get_bone_set_indices(obj, set_name)
+            if bone_indices is not None:
+                start = capture_masked_pose_values(obj, bone_indices)
+                target = mapping.masked_pose_values(obj, armature_pose.values, prefs.reset_unsaved_bones, bone_indices)
+            else:
+                if set_name:
+                    missing_set.append(obj.name)
+                start = capture_pose_values(obj)
+                target = mapping.pose_values(obj, armature_pose.values, prefs.reset_unsaved_bones)
+            self._blends.append((obj, bone_indices, PoseBlend(start, target)))
+        if not self._blends:
+            self.report({'WARNING'}, "No armatures of this pose found in the scene.")
+            return False
+        if missing_set:
+            self.report({'WARNING'}, f"Bone set '{set_name}' not found on {', '.join(missing_set)}; blending all of their bones")
+        return True
+
+    def apply_blends(self, restore=False):
+        for obj, bone_indices, blend in self._blends:
+            values = blend.start if restore else blend.values(self.factor)
+            if bone_indices is not None:
+                apply_masked_pose_values(obj, bone_indices, values)
+            else:
+                apply_pose_values(obj, values)
+
+    def apply_factor(self, context):
+        self.apply_blends()
+        if context.area:
+            context.area.header_text_set(f"Blend Pose '{self.pose_name}': {self.factor:.0%}  (Drag/Wheel: factor, Enter/LMB: confirm, Esc/RMB: cancel)")
+
+    def finish(self, context):
+        if context.area:
+            context.area.header_text_set(None)
+        context.view_layer.update()
+
+    def execute(self, context):
+        if not self.prepare(context):
+            return {'CANCELLED'}
+        self.apply_blends()
+        context.view_layer.update()
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        self.pose_name = ""
+        if not self.prepare(context):
+            return {'CANCELLED'}
+        self._drag_origin = event.mouse_x
+        self._drag_factor = self.factor
+        self.apply_factor(context)
+        context.window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'MOUSEMOVE':
+            self.factor = min(max(self._drag_factor + (event.mouse_x - self._drag_origin) / self.drag_distance, 0.0), 1.0)
+        elif event.type in {'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}:
+            step = self.wheel_step if event.type == 'WHEELUPMOUSE' else -self.wheel_step
+            self.factor = min(max(self.factor + step, 0.0), 1.0)
+            self._drag_origin = event.mouse_x
+            self._drag_factor = self.factor
+        elif event.type in {'LEFTMOUSE', 'RET', 'NUMPAD_ENTER'} and event.value == 'PRESS':
+            self.finish(context)
+            self.report({'INFO'}, f"Blended pose: {self.pose_name} ({self.factor:.0%})")
+            return {'FINISHED'}
+        elif event.type in {'RIGHTMOUSE', 'ESC'} and event.value == 'PRESS':
+            # Restore the pose captured before blending started
+            self.apply_blends(restore=True)
+            self.finish(context)
+            return {'CANCELLED'}
+        else:
+            return {'RUNNING_MODAL'}
+
+        self.apply_factor(context)
+        return {'RUNNING_MODAL'}
+
+class DeletePoseOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.delete"
+    bl_label = "Delete Pose"
+    bl_options = {'UNDO'}
+
+    pose_name: bpy.props.StringProperty()
+
+    def execute(self, context):
+        library = PoseLibrary(context)
+        library.delete_pose(self, self.pose_name)
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        library = PoseLibrary(context)
+        active_lib = library.active_library
+        if active_lib:
+            index = active_lib.poses_index
+            if index >= 0 and index < len(active_lib.poses):
+                self.pose_name = active_lib.poses[index].name
+                return context.window_manager.invoke_confirm(self, event)
+            else:
+                self.report({'WARNING'}, "No pose selected")
+                return {'CANCELLED'}
+        else:
+            self.report({'WARNING'}, "No pose library selected.")
+            return {'CANCELLED'}
+
+class LoadPoseDirectOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.load_direct"
+    bl_label = "Load Pose Directly"
+
+    pose_name: bpy.props.StringProperty()
+    insert_keyframes: bpy.props.BoolProperty(name="Insert Keyframes", description="Key every bone of the loaded armatures at the current frame", default=False)
+    mirror: bpy.props.BoolProperty(name="Mirror", description="Load the pose flipped to the other side of the rig", default=False)
+
+    def execute(self, context):
+        library = PoseLibrary(context)
+        keyframe_frames = [context.scene.frame_current] if self.insert_keyframes else None
+        library.load_pose(self, self.pose_name, keyframe_frames, self.mirror)
+        return {'FINISHED'}
+
+class KeyPoseFramesOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.key_frames"
+    bl_label = "Key Pose on Frames"
+    bl_options = {'UNDO'}
+
+    pose_name: bpy.props.StringProperty()
+    frames: bpy.props.StringProperty(name="Frames", description="Frames to key, separated by commas. Ranges like 10-20 are allowed")
+
+    def execute(self, context):
+        try:
+            frames = parse_frame_list(self.frames)
+        except ValueError:
+            self.report({'WARNING'}, f"Invalid frame list: '{self.frames}'")
+            return {'CANCELLED'}
+        if not frames:
+            self.report({'WARNING'}, "No frames to key")
+            return {'CANCELLED'}
+
+        library = PoseLibrary(context)
+        result = library.key_pose(self, self.pose_name, frames)
+        return result if result else {'FINISHED'}
+
+    def invoke(self, context, event):
+        library = PoseLibrary(context)
+        active_lib = library.active_library
+        if active_lib:
+            index = active_lib.poses_index
+            if index >= 0 and index < len(active_lib.poses):
+                self.pose_name = active_lib.poses[index].name
+                if not self.frames:
+                    self.frames = str(context.scene.frame_current)
+                return context.window_manager.invoke_props_dialog(self)
+            else:
+                self.report({'WARNING'}, "No pose selected")
+                return {'CANCELLED'}
+        else:
+            self.report({'WARNING'}, "No pose library selected.")
+            return {'CANCELLED'}
+
+class MovePoseOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.move_pose"
+    bl_label = "Move Pose"
+
+    direction: bpy.props.EnumProperty(items=(('UP', 'Up', ""), ('DOWN', 'Down', ""),))
+
+    def execute(self, context):
+        scene = context.scene
+        library = PoseLibrary(context).active_library
+        if not library:
+            self.report({'WARNING'}, "No pose library selected.")
+            return {'CANCELLED'}
+
+        index = library.poses_index
+
+        if self.direction == 'UP':
+            new_index = index - 1
+            if new_index >= 0:
+                library.poses.move(index, new_index)
+                library.poses_index = new_index
+                pose_name_index.update(library, index, new_index)
+                pose_list_filter_cache.touch()
+        elif self.direction == 'DOWN':
+            new_index = index + 1
+            if new_index < len(library.poses):
+                library.poses.move(index, new_index)
+                library.poses_index = new_index
+                pose_name_index.update(library, index, new_index)
+                pose_list_filter_cache.touch()
+
+        return {'FINISHED'}
+
+class LinkPoseDatabaseOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.link_database"
+    bl_label = "Store Library in Database"
+    bl_options = {'UNDO'}
+
+    filepath: bpy.props.StringProperty(subtype="FILE_PATH")
+    filter_glob: bpy.props.StringProperty(default="*.db;*.sqlite", options={'HIDDEN'})
+
+    def execute(self, context):
+        library = PoseLibrary(context).active_library
+        if not library:
+            self.report({'WARNING'}, "No active pose library selected.")
+            return {'CANCELLED'}
+
+        if library.storage == 'DATABASE':
+            self.report({'WARNING'}, f"Pose library '{library.name}' is already stored in a database.")
+            return {'CANCELLED'}
+
+        prefs = context.preferences.addons[addon_name].preferences
+        upgrade_library(library, prefs)
+        library.database_path = self.filepath
+        library.database_library = library.name
+        try:
+            store = get_pose_store(library)
+            stored_names = store.pose_names(library.database_library)
+            # Local poses are written to the database before the embedded data goes, so none is
+            # lost. A local pose whose name is taken by a different pose in the database is
+            # written under a new name
+            known_names = set(stored_names)
+            poses = []
+            new_names = {}
+            renamed = 0
+            for index, pose in enumerate(library.poses):
+                pose_name = pose.name
+                data = pose.data
+                if is_legacy_pose_payload(data) or is_pose_reference(data):
+                    data = encode_pose_payload(read_pose(library, pose), prefs.compress_pose_data)
+                if pose_name in known_names:
+                    stored_data = store.read_pose(library.database_library, pose_name)
+                    if stored_data and pose_content_hashes(decode_pose_payload(stored_data)) == pose_content_hashes(decode_pose_payload(data)):
+                        continue
+                    suffix = 1
+                    while pose_name in known_names:
+                        pose_name = f"{pose.name}.{suffix:03d}"
+                        suffix += 1
+                    renamed += 1
+                    new_names[index] = pose_name
+                known_names.add(pose_name)
+                poses.append((pose_name, data))
+            store.write_poses(library.database_library, poses)
+            pose_block_store.release(context.scene, *(pose.data for pose in library.poses))
+            # Tags stay in the .blend file, under the new name of a renamed pose
+            tags = {new_names.get(index, pose.name): pose.tags for index, pose in enumerate(library.poses) if pose.tags}
+            if stored_names:
+                # The database already has this library: list its poses instead of the embedded ones
+                library.poses.clear()
+                for pose_name in stored_names:
+                    library.poses.add().name = pose_name
+                for pose_name, data in poses:
+                    library.poses.add().name = pose_name
+                for pose in library.poses:
+                    pose.tags = tags.get(pose.name, "")
+                message = f"Linked pose library '{library.name}' to {len(stored_names)} poses in the database and added {len(poses)} poses of this file."
+                if renamed:
+                    message += f" {renamed} of them were renamed because the database has a different pose of the same name."
+            else:
+                for index, pose in enumerate(library.poses):
+                    pose.data = ""
+                    if index in new_names:
+                        pose.name = new_names[index]
+                message = f"Moved {len(poses)} poses of '{library.name}' to the database."
+        except (sqlite3.Error, ValueError, KeyError, TypeError, struct.error, zlib.error) as error:
+            library.database_path = ""
+            self.report({'ERROR'}, f"Could not use pose database: {error}")
+            return {'CANCELLED'}
+
+        library.storage = 'DATABASE'
+        library.poses_index = min(library.poses_index, len(library.poses) - 1)
+        pose_name_index.rebuild(library)
+        self.report({'INFO'}, message)
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        if not self.filepath:
+            self.filepath = "poses.db"
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+class SyncPoseDatabaseOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.sync_database"
+    bl_label = "Refresh Library from Database"
+
+    def execute(self, context):
+        library = PoseLibrary(context).active_library
+        if not library or library.storage != 'DATABASE':
+            self.report({'WARNING'}, "The active pose library is not stored in a database.")
+            return {'CANCELLED'}
+
+        try:
+            stored_names = get_pose_store(library).pose_names(library.database_library)
+        except sqlite3.Error as error:
+            self.report({'ERROR'}, f"Could not read pose database: {error}")
+            return {'CANCELLED'}
+
+        # Keep the local order of known poses and append the ones added by other files
+        known_names = set(stored_names)
+        for index in reversed(range(len(library.poses))):
+            if library.poses[index].name not in known_names:
+                library.poses.remove(index)
+        listed_names = set(library.poses.keys())
+        for pose_name in stored_names:
+            if pose_name not in listed_names:
+                library.poses.add().name = pose_name
+        library.poses_index = min(library.poses_index, len(library.poses) - 1)
+        pose_name_index.rebuild(library)
+        pose_feature_index.invalidate(library)
+        self.report({'INFO'}, f"Pose library '{library.name}' has {len(library.poses)} poses in the database.")
+        return {'FINISHED'}
+
+class DeduplicatePosesOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.deduplicate"
+    bl_label = "Deduplicate Pose Data"
+    bl_description = "Share identical armature poses between all the embedded poses of the scene and remove unused pose data"
+    bl_options = {'UNDO'}
+
+    def execute(self, context):
+        scene = context.scene
+        prefs = context.preferences.addons[addon_name].preferences
+        converted = 0
+        for library in scene.pose_libraries:
+            if library.storage != 'EMBEDDED':
+                continue
+            for pose_item in library.poses:
+                if is_pose_reference(pose_item.data):
+                    continue
+                try:
+                    pose = decode_pose_payload(pose_item.data)
+                except (ValueError, KeyError, TypeError, struct.error, zlib.error):
+                    continue
+                if pose:
+                    pose_item.data = pose_block_store.store(scene, pose, prefs.compress_pose_data)
+                    converted += 1
+
+        removed = pose_block_store.collect_garbage(scene)
+        blocks, stored, saved = pose_block_store.statistics(scene)
+        self.report({'INFO'}, f"Deduplicated {converted} poses. {blocks} shared blocks use {stored / 1048576:.2f} MB and save {saved / 1048576:.2f} MB, {removed} unused blocks removed.")
+        return {'FINISHED'}
+
+class UpgradePoseLibrariesOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.upgrade_libraries"
+    bl_label = "Upgrade Pose Libraries"
+    bl_description = "Convert every pose and library of the scene saved by an older version of the addon now, instead of in the background or on first use"
+    bl_options = {'UNDO'}
+
+    def execute(self, context):
+        scene = context.scene
+        if not scene_needs_upgrade(scene):
+            self.report({'INFO'}, "Pose libraries are up to date.")
+            return {'FINISHED'}
+        upgrade_scene(scene, context.preferences.addons[addon_name].preferences)
+        self.report({'INFO'}, "Pose libraries upgraded.")
+        return {'FINISHED'}
+
+class EmbedPoseLibraryOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.embed_library"
+    bl_label = "Embed Library in File"
+    bl_options = {'UNDO'}
+
+    def execute(self, context):
+        library = PoseLibrary(context).active_library
+        if not library or library.storage != 'DATABASE':
+            self.report({'WARNING'}, "The active pose library is not stored in a database.")
+            return {'CANCELLED'}
+
+        try:
+            store = get_pose_store(library)
+            payloads = [store.read_pose(library.database_library, pose.name) for pose in library.poses]
+        except sqlite3.Error as error:
+            self.report({'ERROR'}, f"Could not read pose database: {error}")
+            return {'CANCELLED'}
+
+        library.storage = 'EMBEDDED'
+        prefs = context.preferences.addons[addon_name].preferences
+        for pose, data in zip(library.poses, payloads):
+            if data and prefs.deduplicate_pose_data:
+                data = encode_library_pose(library, decode_pose_payload(data), prefs)
+            pose.data = data or "{}"
+        self.report({'INFO'}, f"Pose library '{library.name}' is now saved in the .blend file.")
+        return {'FINISHED'}
+
+class ExportPoseLibraryOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.export_library"
+    bl_label = "Export Pose Library"
+    
+    filepath: bpy.props.StringProperty(subtype="FILE_PATH")
+    export_all: bpy.props.BoolProperty(
+        name="All Libraries",
+        description="Export every library of the scene into a single compressed archive",
+        default=False
+    )
+
+    def execute(self, context):
+        scene = context.scene
+        prefs = context.preferences.addons[addon_name].preferences
+        if self.export_all:
+            upgrade_scene(scene, prefs)
+            if not scene.pose_libraries:
+                self.report({'WARNING'}, "No pose libraries to export.")
+                return {'CANCELLED'}
+            profile = pose_profiler.start("export_all_libraries")
+            libraries = [
+                (library.name, [(pose.name, read_pose_payload(library, pose) or "{}", pose.tags) for pose in library.poses])
+                for library in scene.pose_libraries
+            ]
+            profile.lap("read")
+            write_library_archive(self.filepath, libraries)
+            profile.lap("encode_and_write")
+            profile.count(libraries=len(libraries), poses=sum(len(poses) for library_name, poses in libraries))
+            profile.stop()
+            self.report({'INFO'}, f"{len(libraries)} pose libraries exported successfully.")
+            return {'FINISHED'}
+
+        library = PoseLibrary(context).active_library
+        if not library:
+            self.report({'WARNING'}, "No active pose library selected.")
+            return {'CANCELLED'}
+        
+        upgrade_library(library, prefs)
+        profile = pose_profiler.start("export_library")
+        poses = [(pose.name, read_pose_payload(library, pose) or "{}", pose.tags) for pose in library.poses]
+        profile.lap("read")
+        document = library_to_export_json(library.name, poses)
+        profile.lap("encode")
+        with open(self.filepath, 'w', encoding='utf-8') as file:
+            file.write(document)
+        profile.lap("write")
+        profile.count(libraries=1, poses=len(poses))
+        profile.stop()
+        
+        self.report({'INFO'}, f"Pose library '{library.name}' exported successfully.")
+        return {'FINISHED'}
+    
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+class ImportPoseLibraryOperator(bpy.types.Operator):
+    bl_idname = "amarillo_pose.import_library"
+    bl_label = "Import Pose Library"
+    
+    filepath: bpy.props.StringProperty(subtype="FILE_PATH")
+
+    # Seconds of importing per timer tick, so the interface stays responsive
+    time_budget = 0.05
+
+    def start(self, context):
+        # Archives hold one library file per entry, plain exports are a single library file
+        if zipfile.is_zipfile(self.filepath):
+            self._archive = zipfile.ZipFile(self.filepath)
+            manifest = json.loads(self._archive.read(LIBRARY_ARCHIVE_MANIFEST))
+            self._pending_entries = list(manifest.get("libraries", []))
+            self._total_size = sum(self._archive.getinfo(entry).file_size for entry in self._pending_entries)
+            if not self._pending_entries:
+                raise ValueError("the archive contains no libraries")
+        else:
+            self._pending_entries = [None]
+            self._total_size = os.path.getsize(self.filepath)
+        self._total_size = max(self._total_size, 1)
+        self._read_size = 0
+        self._pose_count = 0
+        self._library_names = []
+        self._final_names = []
+        self._compress = context.preferences.addons[addon_name].preferences.compress_pose_data
+        self._deduplicate = context.preferences.addons[addon_name].preferences.deduplicate_pose_data
+        self.open_next_library(context)
+
+    def open_next_library(self, context):
+        if not self._pending_entries:
+            return False
+        entry = self._pending_entries.pop(0)
+        if entry is None:
+            self._file = open(self.filepath, 'r', encoding='utf-8')
+        else:
+            self._file = io.TextIOWrapper(self._archive.open(entry), encoding='utf-8')
+        self._reader = LibraryFileReader(self._file)
+        self._entries = self._reader.entries()
+
+        # Until the import finishes the library has a name no other library uses, so it can be
+        # found again after libraries are removed or moved between timer ticks
+        scene = context.scene
+        library_name = "Importing Library"
+        suffix = 1
+        while library_name in scene.pose_libraries or library_name in self._library_names:
+            suffix += 1
+            library_name = f"Importing Library {suffix}"
+        new_library = scene.pose_libraries.add()
+        new_library.name = library_name
+        pose_libraries_changed()
+        self._library_names.append(library_name)
+        self._final_names.append("Imported Library")
+        return True
+
+    def imported_library(self, scene, library_name):
+        library = scene.pose_libraries.get(library_name)
+        if library is None:
+            raise ValueError(f"library '{library_name}' was removed or renamed during the import")
+        return library
+
+    def close_files(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def import_entries(self, context, deadline=None):
+        # Returns True once every library of the file has been read
+        profile = self._profile
+        profile.resume()
+        while True:
+            library = self.imported_library(context.scene, self._library_names[-1])
+            for key, value in self._entries:
+                profile.lap("parse")
+                if key == "pose":
+                    if not isinstance(value, dict):
+                        raise ValueError(f"pose entry is not an object: {str(value)[:60]}")
+                    pose_item = library.poses.add()
+                    pose_item.name = value.get("name", "Unnamed Pose")
+                    if self._deduplicate and "pose" in value:
+                        pose_item.data = pose_block_store.store(context.scene, pose_from_export_data(value["pose"]), self._compress)
+                    else:
+                        pose_item.data = export_entry_payload(value, self._compress)
+                    pose_item.tags = value.get("tags", "")
+                    self._pose_count += 1
+                    profile.lap("add")
+                elif key == "library_name":
+                    if not isinstance(value, str):
+                        raise ValueError("library name is not a string")
+                    self._final_names[-1] = value
+                if deadline is not None and time.perf_counter() > deadline:
+                    return False
+            pose_name_index.rebuild(library)
+            self._read_size += self._reader.characters_read
+            self._file.close()
+            self._file = None
+            if not self.open_next_library(context):
+                return True
+
+    def progress(self):
+        current_size = self._reader.characters_read if self._file is not None else 0
+        return min((self._read_size + current_size) / self._total_size, 1.0)
+
+    def finish(self, context, cancelled=False):
+        self.close_files()
+        scene = context.scene
+        if self._timer is not None:
+            context.window_manager.event_timer_remove(self._timer)
+            context.window_manager.progress_end()
+            context.workspace.status_text_set(None)
+            self._timer = None
+
+        if cancelled:
+            for library_name in self._library_names:
+                index = scene.pose_libraries.find(library_name)
+                if index >= 0:
+                    pose_block_store.release(scene, *(pose.data for pose in scene.pose_libraries[index].poses))
+                    scene.pose_libraries.remove(index)
+            pose_libraries_changed()
+            scene.active_pose_library_index = min(scene.active_pose_library_index, len(scene.pose_libraries) - 1)
+            return {'CANCELLED'}
+
+        try:
+            libraries = [self.imported_library(scene, library_name) for library_name in self._library_names]
+        except ValueError as error:
+            self.report({'ERROR'}, f"Could not finish the import: {error}")
+            return self.finish(context, cancelled=True)
+        for library, final_name in zip(libraries, self._final_names):
+            library.name = final_name
+        self._profile.count(libraries=len(libraries), poses=self._pose_count)
+        self._profile.stop()
+        scene.active_pose_library_index = scene.pose_libraries.find(libraries[-1].name)
+        if len(libraries) == 1:
+            self.report({'INFO'}, f"Pose library '{libraries[0].name}' imported successfully.")
+        else:
+            self.report({'INFO'}, f"{len(libraries)} pose libraries imported successfully.")
+        return {'FINISHED'}
+
+    def execute(self, context):
+        self._timer = None
+        self._archive = None
+        self._file = None
+        self._library_names = []
+        self._profile = pose_profiler.start("import_library")
+        try:
+            self.start(context)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as error:
+            self.report({'ERROR'}, f"Could not open pose library file: {error}")
+            return self.finish(context, cancelled=True)
+        self._profile.lap("open")
+
+        if bpy.app.background or context.window is None:
+            try:
+                self.import_entries(context)
+            except (ValueError, KeyError, TypeError) as error:
+                self.report({'ERROR'}, f"Invalid pose library file: {error}")
+                return self.finish(context, cancelled=True)
+            return self.finish(context)
+
+        window_manager = context.window_manager
+        self._timer = window_manager.event_timer_add(0.01, window=context.window)
+        window_manager.progress_begin(0, 100)
+        window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.report({'INFO'}, "Pose library import cancelled.")
+            return self.finish(context, cancelled=True)
+        if event.type != 'TIMER' or event.timer != self._timer:
+            return {'PASS_THROUGH'}
+
+        try:
+            done = self.import_entries(context, time.perf_counter() + self.time_budget)
+        except (ValueError, KeyError, TypeError) as error:
+            self.report({'ERROR'}, f"Invalid pose library file: {error}")
+            return self.finish(context, cancelled=True)
+        if done:
+            return self.finish(context)
+
+        progress = self.progress()
+        context.window_manager.progress_update(int(progress * 100))
+        context.workspace.status_text_set(f"Importing poses: {self._pose_count} ({progress:.0%}). Press Esc to cancel")
+        return {'RUNNING_MODAL'}
+    
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+classes = (
+    AmarilloExpressionsPreferences,
+    PoseItem,
+    PoseBlock,
+    PoseBoneSetBone,
+    PoseBoneSet,
+    PoseSimilarityResult,
+    PoseLibraryItem,
+    PoseLibraryUIList,
+    PoseLibrariesUIList,
+    PoseLibraryPanel,
+    PoseLibraryBoneSetsPanel,
+    AddBoneSetOperator,
+    RemoveBoneSetOperator,
+    PoseLibrarySimilarPanel,
+    FindSimilarPosesOperator,
+    PoseLibraryStatsPanel,
+    ExportPoseStatsOperator,
+    ResetPoseStatsOperator,
+    AddPoseLibraryOperator,
+    RemovePoseLibraryOperator,
+    RenamePoseLibraryOperator,
+    SavePoseOperator,
+    LoadPoseOperator,
+    BlendPoseOperator,
+    DeletePoseOperator,
+    LoadPoseDirectOperator,
+    KeyPoseFramesOperator,
+    MovePoseOperator,
+    LinkPoseDatabaseOperator,
+    SyncPoseDatabaseOperator,
+    DeduplicatePosesOperator,
+    UpgradePoseLibrariesOperator,
+    EmbedPoseLibraryOperator,
+    ExportPoseLibraryOperator,
+    ImportPoseLibraryOperator,
+)
+
+# Schema versions. Scenes and libraries store the version of the data layout they were last
+# upgraded to, and the migrations below bring older data up to date one version at a time:
+#   scene 0    poses of the single-library versions of the addon are in expression_library
+#   library 0  poses may still hold the original JSON pose data
+# A migration handles the items from a start position on and returns the position to resume
+# from when its deadline passes, or None when it is done. The position is saved with the data,
+# so undo and saving a file halfway through keep it in step
+SCENE_SCHEMA_VERSION = 1
+LIBRARY_SCHEMA_VERSION = 1
+
+def upgrade_expression_library(scene, prefs, start, deadline):
+    # Scene 0 -> 1: copies the old poses into a "Default Library" at the top of the list
+    legacy_poses = getattr(scene, 'expression_library', None)
+    if scene.pose_library_migrated or not legacy_poses:
+        return None
+    if not scene.pose_libraries:
+        start = 0
+    if start == 0:
+        default_lib = scene.pose_libraries.add()
+        default_lib.name = "Default Library"
+        scene.pose_libraries.move(len(scene.pose_libraries) - 1, 0)
+        if len(scene.pose_libraries) > 1:
+            # Keep the same library active
+            scene.active_pose_library_index += 1
+        else:
+            scene.active_pose_library_index = 0
+        pose_libraries_changed()
+
+    default_lib = scene.pose_libraries[0]
+    for index in range(start, len(legacy_poses)):
+        item = legacy_poses[index]
+        new_item = default_lib.poses.add()
+        new_item.name = item.name
+        new_item.data = item.data
+        if deadline is not None and time.perf_counter() > deadline:
+            return index + 1
+
+    del scene.expression_library[:]
+    scene.expression_library_index = 0
+    scene.pose_library_migrated = True
+    pose_name_index.rebuild(default_lib)
+    return None
+
+def upgrade_legacy_pose_payloads(library, prefs, start, deadline):
+    # Library 0 -> 1: encodes JSON poses in the binary payload. Database libraries were
+    # encoded when they were moved to the database
+    if library.storage != 'EMBEDDED':
+        return None
+    poses = library.poses
+    for index in range(start, len(poses)):
+        pose_item = poses[index]
+        data = pose_item.data
+        if is_legacy_pose_payload(data):
+            try:
+                pose_item.data = encode_library_pose(library, decode_pose_payload(data), prefs)
+            except (ValueError, KeyError, TypeError):
+                pass
+        if deadline is not None and time.perf_counter() > deadline:
+            return index + 1
+    return None
+
+# Migration from each version to the next
+SCENE_MIGRATIONS = {
+    0: upgrade_expression_library,
+}
+LIBRARY_MIGRATIONS = {
+    0: upgrade_legacy_pose_payloads,
+}
+
+def run_migrations(target, version_attr, position_attr, migrations, latest_version, prefs, deadline=None):
+    # Returns True once the target is at the latest version
+    version = getattr(target, version_attr)
+    while version < latest_version:
+        position = migrations[version](target, prefs, getattr(target, position_attr), deadline)
+        if position is not None:
+            setattr(target, position_attr, position)
+            return False
+        version += 1
+        setattr(target, version_attr, version)
+        setattr(target, position_attr, 0)
+    return True
+
+def upgrade_library(library, prefs, deadline=None):
+    return run_migrations(library, 'schema_version', 'upgrade_position', LIBRARY_MIGRATIONS, LIBRARY_SCHEMA_VERSION, prefs, deadline)
+
+def upgrade_scene(scene, prefs, deadline=None):
+    if not run_migrations(scene, 'pose_library_schema_version', 'pose_library_upgrade_position', SCENE_MIGRATIONS, SCENE_SCHEMA_VERSION, prefs, deadline):
+        return False
+    return all(upgrade_library(library, prefs, deadline) for library in scene.pose_libraries)
+
+def scene_needs_upgrade(scene):
+    if scene.pose_library_schema_version < SCENE_SCHEMA_VERSION:
+        return True
+    return any(library.schema_version < LIBRARY_SCHEMA_VERSION for library in scene.pose_libraries)
+
+class LibraryUpgrader:
+    # Upgrades old data of every scene from a timer, a few milliseconds per tick, so opening a
+    # file never waits for it. Poses and libraries used before their turn upgrade on first use
+    interval = 0.2
+    time_budget = 0.01
+
+    def schedule(self):
+        if not bpy.app.timers.is_registered(self.upgrade_step):
+            bpy.app.timers.register(self.upgrade_step, first_interval=self.interval)
+
+    def cancel(self):
+        if bpy.app.timers.is_registered(self.upgrade_step):
+            bpy.app.timers.unregister(self.upgrade_step)
+
+    def upgrade_step(self):
+        prefs = bpy.context.preferences.addons[addon_name].preferences
+        if not prefs.upgrade_in_background:
+            return None
+        deadline = time.perf_counter() + self.time_budget
+        for scene in bpy.data.scenes:
+            if scene_needs_upgrade(scene) and not upgrade_scene(scene, prefs, deadline):
+                return self.interval
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'VIEW_3D':
+                    area.tag_redraw()
+        return None
+
+library_upgrader = LibraryUpgrader()
+
+@persistent
+def schedule_library_upgrades(dummy):
+    # Runs after loading a file and after undo/redo, which can bring back data that was upgraded
+    if any(scene_needs_upgrade(scene) for scene in bpy.data.scenes):
+        library_upgrader.schedule()
+
+@persistent
+def rebuild_pose_name_index(dummy):
+    pose_name_index.clear()
+    pose_list_filter_cache.clear()
+    pose_feature_index.clear()
+    pose_block_store.clear()
+    for scene in bpy.data.scenes:
+        for library in getattr(scene, 'pose_libraries', ()):
+            pose_name_index.rebuild(library)
+    # Loading a file can bring its own window manager, and with it its Record Timings setting
+    pose_profiler.enabled = any(getattr(window_manager, 'pose_library_profiling', False) for window_manager in bpy.data.window_managers)
+
+@persistent
+def clear_pose_name_index(dummy):
+    # Undo/redo reallocates the libraries, so indices are rebuilt lazily on next use
+    pose_name_index.clear()
+    pose_list_filter_cache.clear()
+    pose_feature_index.clear()
+    pose_block_store.clear()
+
+@persistent
+def clear_pose_thumbnail_keys(dummy):
+    # Pose data may have changed under the same names, thumbnails are looked up again by hash
+    pose_thumbnails.keys.clear()
+    pose_thumbnails.failed.clear()
+
+def update_pose_profiling(self, context):
+    pose_profiler.enabled = self.pose_library_profiling
+
+def register():
+    for cls in classes:
+        bpy.utils.register_class(cls)
+
+    bpy.types.Scene.expression_library = bpy.props.CollectionProperty(type=PoseItem)
+    bpy.types.Scene.expression_library_index = bpy.props.IntProperty(name="Index for expression_library", default=0)
+    bpy.types.Scene.pose_libraries = bpy.props.CollectionProperty(type=PoseLibraryItem)
+    bpy.types.Scene.pose_blocks = bpy.props.CollectionProperty(type=PoseBlock)
+    bpy.types.Scene.pose_bone_set = bpy.props.StringProperty(
+        name="Bone Set",
+        description="Only save, load and key the bones of the armatures' bone set with this name. Leave empty for every bone",
+        default=""
+    )
+    bpy.types.Object.pose_bone_sets = bpy.props.CollectionProperty(type=PoseBoneSet)
+    bpy.types.Scene.active_pose_library_index = bpy.props.IntProperty(name="Active Pose Library Index", default=0)
+    bpy.types.Scene.pose_library_migrated = bpy.props.BoolProperty(default=False)
+    bpy.types.Scene.pose_library_schema_version = bpy.props.IntProperty(name="Pose Library Schema Version", default=0)
+    bpy.types.Scene.pose_library_upgrade_position = bpy.props.IntProperty(default=0)
+    bpy.types.Scene.pose_target_mode = bpy.props.EnumProperty(
+        name="Pose Targets",
+        description="Armatures that receive a loaded pose",
+        items=(
+            ('NAME', 'Saved Armatures', "Armatures with the names stored in the pose"),
+            ('PATTERN', 'Name Pattern', "Every armature whose name matches a pattern, such as Char.*"),
+            ('COLLECTION', 'Collection', "Every armature in a collection"),
+            ('SELECTED', 'Selected', "Every selected armature"),
+        ),
+        default='NAME'
+    )
+    bpy.types.Scene.pose_target_pattern = bpy.props.StringProperty(name="Target Name Pattern", default="*")
+    bpy.types.Scene.pose_target_collection = bpy.props.PointerProperty(name="Target Collection", type=bpy.types.Collection)
+    bpy.types.Scene.pose_library_view = bpy.props.EnumProperty(
+        name="Pose View",
+        items=(
+            ('LIST', 'List', "Show poses as a list", 'LONGDISPLAY', 0),
+            ('GRID', 'Grid', "Show poses as thumbnails", 'IMGDISPLAY', 1),
+        ),
+        default='LIST'
+    )
+
+    bpy.types.WindowManager.pose_library_profiling = bpy.props.BoolProperty(
+        name="Record Timings",
+        description="Time every phase of the pose operations. Costs almost nothing while disabled",
+        default=False,
+        update=update_pose_profiling
+    )
+    bpy.types.WindowManager.pose_similarity_results = bpy.props.CollectionProperty(type=PoseSimilarityResult)
+    bpy.types.WindowManager.pose_similarity_library = bpy.props.StringProperty()
+
+    pose_thumbnails.register()
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        handlers.append(schedule_library_upgrades)
+    # The file open when the addon is enabled did not go through load_post
+    library_upgrader.schedule()
+    bpy.app.handlers.load_post.append(rebuild_pose_name_index)
+    bpy.app.handlers.undo_post.append(clear_pose_name_index)
+    bpy.app.handlers.redo_post.append(clear_pose_name_index)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        handlers.append(clear_pose_thumbnail_keys)
+
+def unregister():
+    close_pose_stores()
+    pose_thumbnails.unregister()
+    for cls in reversed(classes):
+        bpy.utils.unregister_class(cls)
+    del bpy.types.Scene.pose_libraries
+    del bpy.types.Scene.pose_blocks
+    del bpy.types.Scene.pose_bone_set
+    del bpy.types.Object.pose_bone_sets
+    del bpy.types.Scene.active_pose_library_index
+    del bpy.types.Scene.pose_library_migrated
+    del bpy.types.Scene.pose_library_schema_version
+    del bpy.types.Scene.pose_library_upgrade_position
+    del bpy.types.Scene.pose_target_mode
+    del bpy.types.Scene.pose_target_pattern
+    del bpy.types.Scene.pose_target_collection
+    del bpy.types.Scene.pose_library_view
+    del bpy.types.WindowManager.pose_library_profiling
+    del bpy.types.WindowManager.pose_similarity_results
+    del bpy.types.WindowManager.pose_similarity_library
+    pose_profiler.enabled = False
+
+    if hasattr(bpy.types.Scene, 'expression_library'):
+        del bpy.types.Scene.expression_library
+    if hasattr(bpy.types.Scene, 'expression_library_index'):
+        del bpy.types.Scene.expression_library_index
+
+    library_upgrader.cancel()
+    if rebuild_pose_name_index in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(rebuild_pose_name_index)
+    if clear_pose_name_index in bpy.app.handlers.undo_post:
+        bpy.app.handlers.undo_post.remove(clear_pose_name_index)
+    if clear_pose_name_index in bpy.app.handlers.redo_post:
+        bpy.app.handlers.redo_post.remove(clear_pose_name_index)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        if clear_pose_thumbnail_keys in handlers:
+            handlers.remove(clear_pose_thumbnail_keys)
+        if schedule_library_upgrades in handlers:
+            handlers.remove(schedule_library_upgrades)
+
+if __name__ == "__main__":
+    register()
@@ -0,0 +1,373 @@
+# Pose data and library file formats shared by the addon and the command-line tool.
+# Nothing here imports bpy, only the standard library and NumPy.
+
+import base64
+import hashlib
+import io
+import json
+import numpy
+import re
+import struct
+import zipfile
+import zlib
+
+# Per-bone channel layout of the (bones, POSE_CHANNEL_WIDTH) value arrays
+POSE_CHANNELS = (
+    ('location', 0, 3),
+    ('rotation_quaternion', 3, 4),
+    ('scale', 7, 3),
+)
+POSE_CHANNEL_WIDTH = 10
+REST_POSE_VALUES = numpy.array((0, 0, 0, 1, 0, 0, 0, 1, 1, 1), dtype=numpy.float32)
+
+class ArmaturePose:
+    # Stored bone order and the (bones, POSE_CHANNEL_WIDTH) float32 values of one armature
+    __slots__ = ('bone_names', 'values', 'layout_key')
+
+    def __init__(self, bone_names, values):
+        self.bone_names = bone_names
+        self.values = values
+        self.layout_key = bone_names_key(bone_names)
+
+def bone_names_key(bone_names):
+    # Digest of an ordered bone name list for cache keys. Unlike hash(), two different lists
+    # never share a key by chance
+    return hashlib.blake2b("\0".join(bone_names).encode('utf-8'), digest_size=16).digest()
+
+def sparse_armature_pose(armature_pose, tolerance):
+    # Keeps only the bones that differ from the rest transform
+    posed = (numpy.abs(armature_pose.values - REST_POSE_VALUES) > tolerance).any(axis=1)
+    rows = numpy.flatnonzero(posed)
+    bone_names = armature_pose.bone_names
+    return ArmaturePose([bone_names[row] for row in rows], armature_pose.values[rows])
+
+def pose_data_to_arrays(pose_data):
+    pose = {}
+    for armature_name, armature_data in pose_data.items():
+        values = numpy.array(
+            [bone_data['location'] + bone_data['rotation_quaternion'] + bone_data['scale'] for bone_data in armature_data.values()],
+            dtype=numpy.float32,
+        ).reshape(-1, POSE_CHANNEL_WIDTH)
+        pose[armature_name] = ArmaturePose(list(armature_data.keys()), values)
+    return pose
+
+# Compact pose payload: "APL<version>:" followed by base64 of a flags byte and a body holding,
+# per armature, its name, a bone name table and the packed little-endian float32 channels
+POSE_PAYLOAD_VERSION = 1
+POSE_PAYLOAD_PREFIX = f"APL{POSE_PAYLOAD_VERSION}:"
+PAYLOAD_FLAG_COMPRESSED = 1
+
+def is_legacy_pose_payload(data):
+    return not data.startswith("APL")
+
+def encode_pose_payload(pose, compress=True):
+    chunks = [struct.pack('<H', len(pose))]
+    for armature_name, armature_pose in pose.items():
+        name_bytes = armature_name.encode('utf-8')
+        table_bytes = "\0".join(armature_pose.bone_names).encode('utf-8')
+        chunks.append(struct.pack('<H', len(name_bytes)))
+        chunks.append(name_bytes)
+        chunks.append(struct.pack('<II', len(armature_pose.bone_names), len(table_bytes)))
+        chunks.append(table_bytes)
+        chunks.append(numpy.ascontiguousarray(armature_pose.values, dtype='<f4').tobytes())
+    body = b"".join(chunks)
+
+    flags = 0
+    if compress:
+        body = zlib.compress(body)
+        flags |= PAYLOAD_FLAG_COMPRESSED
+    return POSE_PAYLOAD_PREFIX + base64.b64encode(bytes((flags,)) + body).decode('ascii')
+
+def decode_pose_payload(data):
+    if is_legacy_pose_payload(data):
+        return pose_data_to_arrays(json.loads(data))
+
+    prefix, _, encoded = data.partition(":")
+    if prefix + ":" != POSE_PAYLOAD_PREFIX:
+        raise ValueError(f"Unsupported pose data version '{prefix}'")
+    raw = base64.b64decode(encoded)
+    body = raw[1:]
+    if raw[0] & PAYLOAD_FLAG_COMPRESSED:
+        body = zlib.decompress(body)
+
+    pose = {}
+    (armature_count,) = struct.unpack_from('<H', body, 0)
+    offset = 2
+    for _ in range(armature_count):
+        (name_length,) = struct.unpack_from('<H', body, offset)
+        offset += 2
+        armature_name = body[offset:offset + name_length].decode('utf-8')
+        offset += name_length
+        bone_count, table_length = struct.unpack_from('<II', body, offset)
+        offset += 8
+        bone_names = body[offset:offset + table_length].decode('utf-8').split("\0") if bone_count else []
+        offset += table_length
+        values = numpy.frombuffer(body, dtype='<f4', count=bone_count * POSE_CHANNEL_WIDTH, offset=offset)
+        offset += values.nbytes
+        pose[armature_name] = ArmaturePose(bone_names, values.reshape(bone_count, POSE_CHANNEL_WIDTH))
+    return pose
+
+def pose_payload_hash(data):
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+def armature_pose_hash(armature_pose):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\0".join(armature_pose.bone_names).encode('utf-8'))
+    digest.update(numpy.ascontiguousarray(armature_pose.values, dtype='<f4').tobytes())
+    return digest.hexdigest()
+
+# Exported libraries embed each pose as structured data: per armature, the bone names and
+# one list per channel with the shortest decimals that read back as the same float32 values.
+# Older exports hold the raw PoseItem.data string.
+LIBRARY_FILE_FORMAT = "amarillo_pose_library"
+LIBRARY_FILE_VERSION = 2
+LIBRARY_ARCHIVE_FORMAT = "amarillo_pose_archive"
+LIBRARY_ARCHIVE_VERSION = 1
+LIBRARY_ARCHIVE_MANIFEST = "manifest.json"
+
+def shortest_float32_decimals(values):
+    # float64 copies of float32 values, each the nearest double to the shortest decimal (at most
+    # 9 significant digits) that converts back to the same float32. JSON then writes "0.1"
+    # instead of the 0.10000000149011612 of a plain float32 -> float64 cast
+    values = numpy.asarray(values, dtype=numpy.float32)
+    exact = values.astype(numpy.float64)
+    result = exact.copy()
+    pending = numpy.isfinite(exact) & (exact != 0.0)
+    if not pending.any():
+        return result
+    magnitude = numpy.zeros(exact.shape, dtype=numpy.int64)
+    magnitude[pending] = numpy.floor(numpy.log10(numpy.abs(exact[pending]))).astype(numpy.int64)
+    # Powers of ten are only exact up to 1e22, the rare values further out are converted one by one
+    outside = pending & ((magnitude < -14) | (magnitude > 22))
+    for row in numpy.flatnonzero(outside):
+        result.flat[row] = float(str(values.flat[row]))
+    pending &= ~outside
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        for digits in range(1, 10):
+            # Decimal places for this many significant digits. Dividing or multiplying the rounded
+            # integer by an exact power of ten gives the double nearest to the decimal
+            places = digits - 1 - magnitude[pending]
+            integers = numpy.round(exact[pending] * numpy.power(10.0, places))
+            candidates = numpy.where(
+                places >= 0,
+                integers / numpy.power(10.0, numpy.abs(places)),
+                integers * numpy.power(10.0, numpy.abs(places)),
+            )
+            matches = candidates.astype(numpy.float32) == values[pending]
+            rows = numpy.flatnonzero(pending)[matches]
+            result.flat[rows] = candidates[matches]
+            pending.flat[rows] = False
+            if not pending.any():
+                break
+    return result
+
+def pose_to_export_data(pose):
+    export_data = {}
+    for armature_name, armature_pose in pose.items():
+        values = shortest_float32_decimals(armature_pose.values)
+        armature_data = {"bones": list(armature_pose.bone_names)}
+        for attr, start, width in POSE_CHANNELS:
+            armature_data[attr] = values[:, start:start + width].tolist()
+        export_data[armature_name] = armature_data
+    return export_data
+
+def pose_from_export_data(export_data):
+    if not isinstance(export_data, dict):
+        raise ValueError("exported pose is not an object")
+    pose = {}
+    for armature_name, armature_data in export_data.items():
+        bone_names = armature_data["bones"]
+        channels = [
+            numpy.array(armature_data[attr], dtype=numpy.float32).reshape(len(bone_names), width)
+            for attr, start, width in POSE_CHANNELS
+        ]
+        pose[armature_name] = ArmaturePose(bone_names, numpy.concatenate(channels, axis=1))
+    return pose
+
+def pose_from_export_entry(entry):
+    # Pose of one exported pose, in either the structured or the legacy string layout
+    if "pose" in entry:
+        return pose_from_export_data(entry["pose"])
+    return decode_pose_payload(entry.get("data", "{}"))
+
+def export_entry_payload(entry, compress=True):
+    # Pose data of one exported pose, in either the structured or the legacy string layout
+    if "pose" in entry:
+        return encode_pose_payload(pose_from_export_data(entry["pose"]), compress)
+    return entry.get("data", "{}")
+
+def library_to_export_json(library_name, poses):
+    # poses: (name, PoseItem.data, PoseItem.tags) tuples read from the library on the main thread
+    pose_entries = []
+    for pose_name, data, tags in poses:
+        try:
+            pose_entry = {"name": pose_name, "pose": pose_to_export_data(decode_pose_payload(data))}
+        except (ValueError, KeyError, TypeError, struct.error, zlib.error):
+            pose_entry = {"name": pose_name, "data": data}
+        if tags:
+            pose_entry["tags"] = tags
+        pose_entries.append(pose_entry)
+    export_data = {
+        "format": LIBRARY_FILE_FORMAT,
+        "version": LIBRARY_FILE_VERSION,
+        "library_name": library_name,
+        "poses": pose_entries,
+    }
+    return json.dumps(export_data, separators=(",", ":"))
+
+def write_library_archive(filepath, libraries):
+    # libraries: (library name, poses) pairs. Each library is written as one compressed archive
+    # entry, serialized one at a time so only one document is held in memory
+    entry_names = [f"library_{index:04d}.json" for index in range(len(libraries))]
+    with zipfile.ZipFile(filepath, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        manifest = {
+            "format": LIBRARY_ARCHIVE_FORMAT,
+            "version": LIBRARY_ARCHIVE_VERSION,
+            "libraries": entry_names,
+        }
+        archive.writestr(LIBRARY_ARCHIVE_MANIFEST, json.dumps(manifest, indent=4))
+        for entry_name, library in zip(entry_names, libraries):
+            archive.writestr(entry_name, library_to_export_json(*library))
+
+class LibraryFileReader:
+    # Reads an exported library incrementally. The top-level object is scanned key by key and
+    # the "poses" array is decoded one element at a time, so only the current pose and one
+    # chunk of the file are held in memory.
+    whitespace = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, file, chunk_size=1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.characters_read = 0
+        self.eof = False
+
+    def read_more(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        self.characters_read += len(chunk)
+        return True
+
+    def peek(self):
+        while True:
+            self.position = self.whitespace.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                raise ValueError("Unexpected end of pose library file")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' in pose library file")
+        self.position += 1
+
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self.read_more():
+                    continue
+                raise
+            # A number ending exactly at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self.read_more():
+                continue
+            self.position = end
+            return value
+
+    def entries(self):
+        # Yields ("pose", pose) for every element of "poses" and (key, value) for other keys
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            key = self.decode_value()
+            self.expect(":")
+            if key == "poses" and self.peek() == "[":
+                self.position += 1
+                if self.peek() != "]":
+                    while True:
+                        yield "pose", self.decode_value()
+                        if self.peek() != ",":
+                            break
+                        self.position += 1
+                self.expect("]")
+            else:
+                yield key, self.decode_value()
+            if self.peek() != ",":
+                break
+            self.position += 1
+        self.expect("}")
+
+class LibraryFileWriter:
+    # Writes an exported library one pose at a time. Top-level keys other than the format
+    # are written after the poses, LibraryFileReader accepts them in any order
+    def __init__(self, file):
+        self.file = file
+        self.pose_count = 0
+        file.write(f'{{"format":{json.dumps(LIBRARY_FILE_FORMAT)},"version":{LIBRARY_FILE_VERSION},"poses":[')
+
+    def write_pose(self, entry):
+        if self.pose_count:
+            self.file.write(",")
+        self.file.write(json.dumps(entry, separators=(",", ":")))
+        self.pose_count += 1
+
+    def close(self, **keys):
+        self.file.write("]")
+        for key, value in keys.items():
+            self.file.write(f",{json.dumps(key)}:{json.dumps(value, separators=(',', ':'))}")
+        self.file.write("}")
+
+def read_library_files(filepath, chunk_size=1 << 20):
+    # Yields (archive entry name, LibraryFileReader) for every library of an archive, or
+    # (None, LibraryFileReader) for a plain export
+    if zipfile.is_zipfile(filepath):
+        with zipfile.ZipFile(filepath) as archive:
+            manifest = json.loads(archive.read(LIBRARY_ARCHIVE_MANIFEST))
+            if manifest.get("format") != LIBRARY_ARCHIVE_FORMAT:
+                raise ValueError("not a pose library archive")
+            for entry_name in manifest.get("libraries", []):
+                with io.TextIOWrapper(archive.open(entry_name), encoding='utf-8') as file:
+                    yield entry_name, LibraryFileReader(file, chunk_size)
+    else:
+        with open(filepath, 'r', encoding='utf-8') as file:
+            yield None, LibraryFileReader(file, chunk_size)
+
+class LibraryOutput:
+    # A plain export holding one library, or an archive with one entry per library when the
+    # path ends in .zip. Each library is written through a LibraryFileWriter
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.entry_names = []
+        self.archive = None
+        if filepath.lower().endswith(".zip"):
+            self.archive = zipfile.ZipFile(filepath, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def open_library(self):
+        # The previous library's file has to be closed before the next one is opened
+        if self.archive is None:
+            if self.entry_names:
+                raise ValueError("a .json file holds a single library, write to a .zip archive instead")
+            self.entry_names.append(None)
+            return open(self.filepath, 'w', encoding='utf-8')
+        entry_name = f"library_{len(self.entry_names):04d}.json"
+        self.entry_names.append(entry_name)
+        return io.TextIOWrapper(self.archive.open(entry_name, 'w'), encoding='utf-8')
+
+    def close(self):
+        if self.archive is not None:
+            manifest = {
+                "format": LIBRARY_ARCHIVE_FORMAT,
+                "version": LIBRARY_ARCHIVE_VERSION,
+                "libraries": self.entry_names,
+            }
+            self.archive.writestr(LIBRARY_ARCHIVE_MANIFEST, json.dumps(manifest, indent=4))
+            self.archive.close()
@@ -0,0 +1,295 @@
+# Command-line tool for exported pose library files (.json exports and .zip archives).
+# It only needs Python 3 and NumPy, not Blender, so it runs on farm machines:
+#
+#   python pose_library_tool.py validate libraries/*.json
+#   python pose_library_tool.py merge merged.zip a.json b.zip --dedupe
+#   python pose_library_tool.py convert --output-dir upgraded old/*.json
+#   python pose_library_tool.py dedupe --output-dir clean libraries/*.json
+#   python pose_library_tool.py compact --output-dir small --tolerance 1e-5 libraries/*.json
+#
+# Files are read and written one pose at a time, and separate files are processed in parallel
+# by a process pool (--jobs).
+#
+# Run it by path as above, not with python -m: the AmarillosPoseLibrary package is the Blender
+# addon and importing it needs bpy. Blender never loads this file from the installed addon.
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+# library_format sits next to this file and is imported as a top-level module
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from library_format import (
+    LIBRARY_FILE_FORMAT,
+    LIBRARY_FILE_VERSION,
+    LibraryFileWriter,
+    LibraryOutput,
+    pose_from_export_entry,
+    pose_to_export_data,
+    read_library_files,
+    sparse_armature_pose,
+)
+
+POSE_ERRORS = (ValueError, KeyError, TypeError, struct.error, zlib.error)
+READ_ERRORS = (OSError, ValueError, KeyError, zipfile.BadZipFile)
+
+def pose_problems(entry, seen_names):
+    # (errors, warnings) of one exported pose
+    errors = []
+    warnings = []
+    name = entry.get("name") if isinstance(entry, dict) else None
+    if not isinstance(name, str):
+        return [f"pose without a name: {str(entry)[:60]}"], warnings
+    if name in seen_names:
+        warnings.append(f"'{name}': duplicate pose name")
+    seen_names.add(name)
+
+    try:
+        pose = pose_from_export_entry(entry)
+    except POSE_ERRORS as error:
+        return [f"'{name}': unreadable pose data ({error})"], warnings
+    if not pose:
+        warnings.append(f"'{name}': empty pose")
+    for armature_name, armature_pose in pose.items():
+        values = armature_pose.values
+        if not numpy.isfinite(values).all():
+            errors.append(f"'{name}': non-finite values for armature '{armature_name}'")
+            continue
+        norms = numpy.linalg.norm(values[:, 3:7], axis=1)
+        unnormalized = int(numpy.count_nonzero(numpy.abs(norms - 1.0) > 1e-3))
+        if unnormalized:
+            warnings.append(f"'{name}': {unnormalized} bones of '{armature_name}' have unnormalized rotations")
+    return errors, warnings
+
+def validate_file(filepath):
+    report = {"file": filepath, "libraries": 0, "poses": 0, "errors": [], "warnings": []}
+    try:
+        for entry_name, reader in read_library_files(filepath):
+            report["libraries"] += 1
+            where = f"{entry_name}: " if entry_name else ""
+            keys = {}
+            seen_names = set()
+            for key, value in reader.entries():
+                if key != "pose":
+                    keys[key] = value
+                    continue
+                report["poses"] += 1
+                errors, warnings = pose_problems(value, seen_names)
+                report["errors"].extend(where + message for message in errors)
+                report["warnings"].extend(where + message for message in warnings)
+
+            if "format" not in keys:
+                report["warnings"].append(f"{where}old export without a format marker")
+            elif keys["format"] != LIBRARY_FILE_FORMAT:
+                report["errors"].append(f"{where}unknown format '{keys['format']}'")
+            elif not isinstance(keys.get("version"), int) or keys["version"] > LIBRARY_FILE_VERSION:
+                report["errors"].append(f"{where}unsupported version {keys.get('version')!r}")
+            if "library_name" not in keys:
+                report["warnings"].append(f"{where}no library name")
+    except READ_ERRORS as error:
+        report["errors"].append(f"cannot read file: {error}")
+    return report
+
+class PoseFilter:
+    # Rewrites exported poses in the current structured layout, optionally leaving out rest
+    # bones (compact) and poses whose content was already written (dedupe)
+    def __init__(self, dedupe=False, tolerance=None):
+        self.seen = set() if dedupe else None
+        self.tolerance = tolerance
+        self.written = 0
+        self.duplicates = 0
+        self.unreadable = 0
+        self.bones_removed = 0
+
+    def __call__(self, entry):
+        try:
+            pose = pose_from_export_entry(entry)
+        except POSE_ERRORS:
+            # Kept untouched so nothing is lost, validate reports it
+            self.unreadable += 1
+            self.written += 1
+            return entry
+
+        if self.tolerance is not None:
+            sparse_pose = {armature_name: sparse_armature_pose(armature_pose, self.tolerance) for armature_name, armature_pose in pose.items()}
+            self.bones_removed += sum(len(pose[armature_name].bone_names) - len(armature_pose.bone_names) for armature_name, armature_pose in sparse_pose.items())
+            pose = sparse_pose
+
+        export_data = pose_to_export_data(pose)
+        if self.seen is not None:
+            content_hash = hashlib.blake2b(json.dumps(export_data, sort_keys=True).encode('utf-8'), digest_size=16).digest()
+            if content_hash in self.seen:
+                self.duplicates += 1
+                return None
+            self.seen.add(content_hash)
+
+        result = {"name": entry.get("name", "Unnamed Pose"), "pose": export_data}
+        if entry.get("tags"):
+            result["tags"] = entry["tags"]
+        self.written += 1
+        return result
+
+    def summary(self):
+        return {
+            "poses": self.written,
+            "duplicates_removed": self.duplicates,
+            "unreadable_kept": self.unreadable,
+            "bones_removed": self.bones_removed,
+        }
+
+def copy_library(reader, writer, pose_filter):
+    keys = {}
+    for key, value in reader.entries():
+        if key == "pose":
+            entry = pose_filter(value)
+            if entry is not None:
+                writer.write_pose(entry)
+        elif key not in ("format", "version", "poses"):
+            keys[key] = value
+    writer.close(**keys)
+
+def transform_file(job):
+    # Copies every library of one file through a PoseFilter into the same kind of file
+    filepath, output_path, dedupe, tolerance = job
+    if zipfile.is_zipfile(filepath) and not output_path.lower().endswith(".zip"):
+        output_path += ".zip"
+    pose_filter = PoseFilter(dedupe, tolerance)
+    report = {"file": filepath, "output": output_path, "errors": []}
+    try:
+        output = LibraryOutput(output_path)
+        try:
+            for entry_name, reader in read_library_files(filepath):
+                with output.open_library() as file:
+                    copy_library(reader, LibraryFileWriter(file), pose_filter)
+        finally:
+            output.close()
+    except READ_ERRORS as error:
+        report["errors"].append(str(error))
+    report.update(pose_filter.summary())
+    return report
+
+def merge_files(filepaths, output_path, dedupe, library_name):
+    # Streams every input library into one archive entry each, or into a single library for a
+    # .json output. Name clashes in a single library get a numbered suffix
+    pose_filter = PoseFilter(dedupe)
+    single = not output_path.lower().endswith(".zip")
+    output = LibraryOutput(output_path)
+    report = {"file": output_path, "inputs": len(filepaths), "libraries": 0, "errors": []}
+    used_names = set()
+
+    def rename(entry):
+        name = base_name = entry.get("name", "Unnamed Pose")
+        suffix = 1
+        while name in used_names:
+            suffix += 1
+            name = f"{base_name} ({suffix})"
+        used_names.add(name)
+        return {**entry, "name": name}
+
+    try:
+        if single:
+            with output.open_library() as file:
+                writer = LibraryFileWriter(file)
+                for filepath in filepaths:
+                    try:
+                        for entry_name, reader in read_library_files(filepath):
+                            for key, value in reader.entries():
+                                if key == "pose":
+                                    entry = pose_filter(value)
+                                    if entry is not None:
+                                        writer.write_pose(rename(entry))
+                            report["libraries"] += 1
+                    except READ_ERRORS as error:
+                        report["errors"].append(f"{filepath}: {error}")
+                writer.close(library_name=library_name or os.path.splitext(os.path.basename(output_path))[0])
+        else:
+            for filepath in filepaths:
+                try:
+                    for entry_name, reader in read_library_files(filepath):
+                        with output.open_library() as file:
+                            copy_library(reader, LibraryFileWriter(file), pose_filter)
+                        report["libraries"] += 1
+                except READ_ERRORS as error:
+                    report["errors"].append(f"{filepath}: {error}")
+    finally:
+        output.close()
+    report.update(pose_filter.summary())
+    return report
+
+def run_jobs(function, jobs, workers):
+    if workers == 1 or len(jobs) < 2:
+        return [function(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, jobs))
+
+def print_report(report, as_json):
+    if as_json:
+        print(json.dumps(report))
+        return
+    details = ", ".join(f"{key} {value}" for key, value in report.items() if key not in ("file", "output", "errors", "warnings") and value)
+    status = "FAILED" if report["errors"] else "ok"
+    print(f"{report['file']}: {status}" + (f" ({details})" if details else ""))
+    for message in report["errors"]:
+        print(f"  error: {message}")
+    for message in report.get("warnings", ()):
+        print(f"  warning: {message}")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Validate, merge and convert Amarillo's Pose Library files without Blender")
+    parser.add_argument("--jobs", type=int, default=None, help="Files processed in parallel (default: one per CPU)")
+    parser.add_argument("--json", action="store_true", help="Print one JSON report per line")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    validate = commands.add_parser("validate", help="Check that files can be imported and report broken poses")
+    validate.add_argument("files", nargs="+")
+
+    merge = commands.add_parser("merge", help="Combine files into one archive (.zip) or one library (.json)")
+    merge.add_argument("output")
+    merge.add_argument("files", nargs="+")
+    merge.add_argument("--dedupe", action="store_true", help="Leave out poses identical to one already merged")
+    merge.add_argument("--library-name", help="Name of the merged library for a .json output")
+
+    for name, description in (
+        ("convert", "Rewrite files in the current format, upgrading old exports"),
+        ("dedupe", "Remove poses identical to an earlier pose of the same file"),
+        ("compact", "Leave out the bones at their rest transform"),
+    ):
+        command = commands.add_parser(name, help=description)
+        command.add_argument("files", nargs="+")
+        command.add_argument("--output-dir", required=True, help="Folder for the rewritten files, the inputs are not modified")
+        if name == "compact":
+            command.add_argument("--tolerance", type=float, default=1e-5, help="Largest difference from the rest transform for a bone to be left out")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    if args.command == "validate":
+        reports = run_jobs(validate_file, args.files, args.jobs)
+    elif args.command == "merge":
+        reports = [merge_files(args.files, args.output, args.dedupe, args.library_name)]
+    else:
+        os.makedirs(args.output_dir, exist_ok=True)
+        jobs = []
+        for filepath in args.files:
+            output_path = os.path.join(args.output_dir, os.path.basename(filepath))
+            if os.path.abspath(output_path) == os.path.abspath(filepath):
+                print(f"{filepath}: output would overwrite the input, choose another --output-dir", file=sys.stderr)
+                return 2
+            jobs.append((filepath, output_path, args.command == "dedupe", getattr(args, "tolerance", None)))
+        reports = run_jobs(transform_file, jobs, args.jobs)
+
+    for report in reports:
+        print_report(report, args.json)
+    return 1 if any(report["errors"] for report in reports) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+# Headless benchmarks for Amarillo's Pose Library.
+#
+# Run inside background Blender:
+#   blender -b --factory-startup --python-exit-code 1 --python benchmarks/benchmark_pose_library.py -- --output results.json
+# or with the bpy module from PyPI:
+#   python benchmarks/benchmark_pose_library.py --output results.json
+#
+# Pass --baseline with the results of an earlier run to fail when an operation got slower than
+# --tolerance times its baseline median, and --thresholds with a JSON file of absolute limits
+# ({"scenario/operation": max_median_ms}).
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import bpy
+import addon_utils
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AmarillosPoseLibrary as addon
+
+# name, bones per armature, armatures, poses in the library
+SCENARIOS = (
+    ("rig_100x1_lib_10", 100, 1, 10),
+    ("rig_1000x1_lib_100", 1000, 1, 100),
+    ("rig_5000x1_lib_100", 5000, 1, 100),
+    ("rig_500x10_lib_100", 500, 10, 100),
+    ("rig_100x1_lib_1000", 100, 1, 1000),
+    ("rig_100x1_lib_10000", 100, 1, 10000),
+)
+QUICK_SCENARIOS = SCENARIOS[:2]
+
+class Reporter:
+    # Stands in for the operator passed to PoseLibrary methods and keeps the last report
+    def __init__(self):
+        self.last_report = None
+
+    def report(self, level, message):
+        self.last_report = (level, message)
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Benchmark Amarillo's Pose Library")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--quick", action="store_true", help="Only run the smallest scenarios")
+    parser.add_argument("--scenario", action="append", help="Only run scenarios with these names")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per operation")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Allowed slowdown against the baseline")
+    parser.add_argument("--thresholds", help="JSON file with absolute limits in milliseconds")
+    return parser.parse_args(argv)
+
+def clear_scene():
+    scene = bpy.context.scene
+    scene.pose_libraries.clear()
+    scene.pose_blocks.clear()
+    scene.active_pose_library_index = 0
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj)
+    for armature in list(bpy.data.armatures):
+        bpy.data.armatures.remove(armature)
+    for action in list(bpy.data.actions):
+        bpy.data.actions.remove(action)
+    addon.decoded_pose_cache.clear()
+    addon.bone_mapping_cache.clear()
+    addon.pose_name_index.clear()
+    addon.pose_block_store.clear()
+    addon.pose_feature_index.clear()
+    addon.pose_list_filter_cache.clear()
+    addon.bone_symmetry_cache.clear()
+    addon.bone_set_cache.clear()
+
+def build_armature(name, bone_count):
+    armature = bpy.data.armatures.new(name)
+    obj = bpy.data.objects.new(name, armature)
+    bpy.context.scene.collection.objects.link(obj)
+    bpy.context.view_layer.objects.active = obj
+    bpy.ops.object.mode_set(mode='EDIT')
+    parent = None
+    for index in range(bone_count):
+        bone = armature.edit_bones.new(f"bone_{index:05d}")
+        bone.head = (index % 50 * 0.1, index // 50 * 0.1, 0.0)
+        bone.tail = (bone.head[0], bone.head[1], 0.1)
+        if index % 10:
+            bone.parent = parent
+        parent = bone
+    bpy.ops.object.mode_set(mode='OBJECT')
+    return obj
+
+def randomize_pose(obj, rng):
+    # Poses roughly a third of the bones, the rest stay at rest
+    values = numpy.tile(addon.REST_POSE_VALUES, (len(obj.pose.bones), 1))
+    posed = rng.random(len(values)) < 0.3
+    values[posed, 0:3] = rng.normal(scale=0.1, size=(posed.sum(), 3))
+    rotations = rng.normal(size=(posed.sum(), 4))
+    values[posed, 3:7] = rotations / numpy.linalg.norm(rotations, axis=1)[:, None]
+    addon.apply_pose_values(obj, values.astype(numpy.float32))
+
+def timed(samples, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    samples.append((time.perf_counter() - start) * 1000.0)
+    return result
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.fmean(samples),
+        "min_ms": min(samples),
+        "max_ms": max(samples),
+    }
+
+def run_scenario(name, bone_count, armature_count, pose_count, repeat, rng):
+    clear_scene()
+    context = bpy.context
+    scene = context.scene
+    prefs = context.preferences.addons[addon.addon_name].preferences
+    armatures = [build_armature(f"Rig_{index:02d}", bone_count) for index in range(armature_count)]
+    prefs.armature_names = ",".join(obj.name for obj in armatures)
+    context.view_layer.objects.active = None
+
+    library = scene.pose_libraries.add()
+    library.name = name
+    scene.active_pose_library_index = 0
+    pose_library = addon.PoseLibrary(context)
+    reporter = Reporter()
+    timings = {}
+
+    # Fill the library, timing every save
+    save_samples = []
+    for index in range(pose_count):
+        for obj in armatures:
+            randomize_pose(obj, rng)
+        timed(save_samples, pose_library.save_pose, reporter, f"Pose {index:05d}")
+    timings["save_pose"] = summarize(save_samples)
+
+    pose_names = [pose.name for pose in library.poses]
+    picks = [pose_names[index] for index in rng.integers(0, len(pose_names), repeat)]
+
+    cold_samples = []
+    for pose_name in picks:
+        addon.decoded_pose_cache.clear()
+        addon.bone_mapping_cache.clear()
+        timed(cold_samples, pose_library.load_pose, reporter, pose_name)
+    timings["load_pose_cold"] = summarize(cold_samples)
+
+    warm_samples = []
+    for pose_name in picks:
+        pose_library.load_pose(reporter, pose_name)
+        timed(warm_samples, pose_library.load_pose, reporter, pose_name)
+    timings["load_pose_warm"] = summarize(warm_samples)
+
+    with tempfile.TemporaryDirectory() as directory:
+        export_path = os.path.join(directory, "library.json")
+        archive_path = os.path.join(directory, "libraries.zip")
+        export_samples = []
+        import_samples = []
+        export_all_samples = []
+        import_archive_samples = []
+        for _ in range(max(1, repeat // 10)):
+            timed(export_samples, bpy.ops.amarillo_pose.export_library, filepath=export_path)
+            timed(export_all_samples, bpy.ops.amarillo_pose.export_library, filepath=archive_path, export_all=True)
+            timed(import_samples, bpy.ops.amarillo_pose.import_library, filepath=export_path)
+            bpy.ops.amarillo_pose.remove_library()
+            timed(import_archive_samples, bpy.ops.amarillo_pose.import_library, filepath=archive_path)
+            bpy.ops.amarillo_pose.remove_library()
+        scene.active_pose_library_index = 0
+        timings["export_library"] = summarize(export_samples)
+        timings["export_all_libraries"] = summarize(export_all_samples)
+        timings["import_library"] = summarize(import_samples)
+        timings["import_archive"] = summarize(import_archive_samples)
+        export_size = os.path.getsize(export_path)
+        archive_size = os.path.getsize(archive_path)
+
+    delete_samples = []
+    for pose_name in pose_names[:min(repeat, len(pose_names))]:
+        timed(delete_samples, pose_library.delete_pose, reporter, pose_name)
+    timings["delete_pose"] = summarize(delete_samples)
+
+    return {
+        "name": name,
+        "bones": bone_count,
+        "armatures": armature_count,
+        "poses": pose_count,
+        "export_bytes": export_size,
+        "archive_bytes": archive_size,
+        "timings": timings,
+    }
+
+def check_regressions(results, baseline_path, tolerance, thresholds_path):
+    failures = []
+    medians = {
+        f"{scenario['name']}/{operation}": timing["median_ms"]
+        for scenario in results["scenarios"]
+        for operation, timing in scenario["timings"].items()
+    }
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        for scenario in baseline["scenarios"]:
+            for operation, timing in scenario["timings"].items():
+                key = f"{scenario['name']}/{operation}"
+                if key in medians and medians[key] > timing["median_ms"] * tolerance:
+                    failures.append(f"{key}: {medians[key]:.2f} ms, baseline {timing['median_ms']:.2f} ms")
+    if thresholds_path:
+        with open(thresholds_path, 'r', encoding='utf-8') as file:
+            thresholds = json.load(file)
+        for key, limit in thresholds.items():
+            if key in medians and medians[key] > limit:
+                failures.append(f"{key}: {medians[key]:.2f} ms, limit {limit:.2f} ms")
+    return failures
+
+def main():
+    args = parse_args()
+    addon_utils.enable(addon.__name__, default_set=True)
+    rng = numpy.random.default_rng(0)
+
+    scenarios = QUICK_SCENARIOS if args.quick else SCENARIOS
+    if args.scenario:
+        scenarios = [scenario for scenario in SCENARIOS if scenario[0] in args.scenario]
+
+    results = {
+        "blender": bpy.app.version_string,
+        "addon_version": ".".join(str(part) for part in addon.bl_info["version"]),
+        "numpy": numpy.__version__,
+        "repeat": args.repeat,
+        "scenarios": [],
+    }
+    for name, bone_count, armature_count, pose_count in scenarios:
+        start = time.perf_counter()
+        scenario = run_scenario(name, bone_count, armature_count, pose_count, args.repeat, rng)
+        results["scenarios"].append(scenario)
+        print(f"{name}: {time.perf_counter() - start:.1f} s")
+        for operation, timing in scenario["timings"].items():
+            print(f"  {operation:<22} median {timing['median_ms']:9.2f} ms  (n={timing['count']})")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=4)
+
+    failures = check_regressions(results, args.baseline, args.tolerance, args.thresholds)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
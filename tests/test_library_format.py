@@ -0,0 +1,224 @@
+# Tests for the Blender-free parts of the addon: the pose payload codec, the library file
+# reader and writer, and the command-line tool. Run with: python -m pytest tests
+
+import io
+import json
+import os
+import sys
+import zipfile
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "AmarillosPoseLibrary"))
+import library_format
+import pose_library_tool
+from library_format import (
+    POSE_CHANNEL_WIDTH,
+    REST_POSE_VALUES,
+    ArmaturePose,
+    LibraryFileReader,
+    LibraryFileWriter,
+    armature_pose_hash,
+    decode_pose_payload,
+    encode_pose_payload,
+    is_legacy_pose_payload,
+    library_to_export_json,
+    pose_from_export_data,
+    pose_to_export_data,
+    sparse_armature_pose,
+    write_library_archive,
+)
+
+def make_pose(seed=0, bone_count=20, armature_names=("Body", "Face")):
+    rng = numpy.random.default_rng(seed)
+    pose = {}
+    for armature_name in armature_names:
+        values = rng.normal(size=(bone_count, POSE_CHANNEL_WIDTH)).astype(numpy.float32)
+        pose[armature_name] = ArmaturePose([f"{armature_name}_bone_{index}" for index in range(bone_count)], values)
+    return pose
+
+def assert_same_pose(pose, other):
+    assert list(pose) == list(other)
+    for armature_name, armature_pose in pose.items():
+        assert list(other[armature_name].bone_names) == list(armature_pose.bone_names)
+        numpy.testing.assert_array_equal(other[armature_name].values, armature_pose.values)
+
+def legacy_payload(pose):
+    return json.dumps({
+        armature_name: {
+            bone_name: {
+                "location": row[0:3].tolist(),
+                "rotation_quaternion": row[3:7].tolist(),
+                "scale": row[7:10].tolist(),
+            }
+            for bone_name, row in zip(armature_pose.bone_names, armature_pose.values)
+        }
+        for armature_name, armature_pose in pose.items()
+    })
+
+def write_export(path, library_name, poses):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(library_to_export_json(library_name, [(name, encode_pose_payload(pose), "") for name, pose in poses]))
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_payload_round_trip(compress):
+    pose = make_pose()
+    data = encode_pose_payload(pose, compress)
+    assert not is_legacy_pose_payload(data)
+    assert_same_pose(pose, decode_pose_payload(data))
+
+def test_empty_pose_round_trip():
+    pose = {"Rig": ArmaturePose([], numpy.empty((0, POSE_CHANNEL_WIDTH), dtype=numpy.float32))}
+    decoded = decode_pose_payload(encode_pose_payload(pose))
+    assert decoded["Rig"].bone_names == []
+    assert decoded["Rig"].values.shape == (0, POSE_CHANNEL_WIDTH)
+
+def test_legacy_payload_decodes():
+    pose = make_pose(armature_names=("Rig",))
+    data = legacy_payload(pose)
+    assert is_legacy_pose_payload(data)
+    assert_same_pose(pose, decode_pose_payload(data))
+
+def test_unknown_payload_version_is_rejected():
+    with pytest.raises(ValueError):
+        decode_pose_payload("APL9:AAAA")
+
+def test_export_data_is_exact():
+    pose = make_pose()
+    pose["Body"].values[0, 0] = 1e-9
+    pose["Body"].values[1, 1] = -3.3e-7
+    exported = pose_from_export_data(json.loads(json.dumps(pose_to_export_data(pose))))
+    assert_same_pose(pose, exported)
+    assert armature_pose_hash(exported["Body"]) == armature_pose_hash(pose["Body"])
+
+def test_export_data_uses_shortest_decimals():
+    values = numpy.tile(REST_POSE_VALUES, (2, 1))
+    values[0, 0] = 0.1
+    values[1, 2] = 1e-30
+    document = json.dumps(pose_to_export_data({"Rig": ArmaturePose(["a", "b"], values)}))
+    assert "0.1," in document and "1e-30" in document
+    assert "0.10000000149011612" not in document
+
+def test_export_data_must_be_an_object():
+    with pytest.raises(ValueError):
+        pose_from_export_data([1])
+
+def test_sparse_pose_keeps_posed_bones():
+    values = numpy.tile(REST_POSE_VALUES, (4, 1))
+    values[2, 0] = 0.5
+    sparse = sparse_armature_pose(ArmaturePose(["a", "b", "c", "d"], values), 1e-5)
+    assert sparse.bone_names == ["c"]
+    numpy.testing.assert_array_equal(sparse.values, values[2:3])
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_reader_handles_chunk_boundaries(chunk_size):
+    # Numbers, strings and escapes split across chunks must decode the same as in one piece
+    document = json.dumps({
+        "format": "amarillo_pose_library",
+        "version": 2,
+        "poses": [{"name": "a \"quoted\" é", "value": 1234567.125}, {"name": "b", "value": -0.5e-7}, 42],
+        "library_name": "Library",
+    }, indent=1)
+    reader = LibraryFileReader(io.StringIO(document), chunk_size)
+    entries = list(reader.entries())
+    assert entries == [
+        ("format", "amarillo_pose_library"),
+        ("version", 2),
+        ("pose", {"name": "a \"quoted\" é", "value": 1234567.125}),
+        ("pose", {"name": "b", "value": -0.5e-7}),
+        ("pose", 42),
+        ("library_name", "Library"),
+    ]
+    assert reader.characters_read == len(document)
+
+def test_reader_rejects_truncated_file():
+    reader = LibraryFileReader(io.StringIO('{"poses":[{"name":"a"},'), 4)
+    with pytest.raises(ValueError):
+        list(reader.entries())
+
+def test_writer_output_reads_back():
+    file = io.StringIO()
+    writer = LibraryFileWriter(file)
+    writer.write_pose({"name": "a"})
+    writer.write_pose({"name": "b"})
+    writer.close(library_name="Library")
+    entries = list(LibraryFileReader(io.StringIO(file.getvalue()), 5).entries())
+    assert ("pose", {"name": "b"}) in entries
+    assert ("library_name", "Library") in entries
+    assert json.loads(file.getvalue())["version"] == library_format.LIBRARY_FILE_VERSION
+
+def test_archive_round_trip(tmp_path):
+    path = str(tmp_path / "libraries.zip")
+    pose = make_pose()
+    write_library_archive(path, [("First", [("Pose", encode_pose_payload(pose), "tag")]), ("Second", [])])
+    libraries = []
+    for entry_name, reader in library_format.read_library_files(path):
+        libraries.append(dict((key, value) for key, value in reader.entries() if key != "pose"))
+    assert [library["library_name"] for library in libraries] == ["First", "Second"]
+
+def test_validate_reports_broken_poses(tmp_path, capsys):
+    good = tmp_path / "good.json"
+    write_export(good, "Good", [("A", make_pose(0)), ("B", make_pose(1))])
+    broken = tmp_path / "broken.json"
+    broken.write_text(json.dumps({"format": "amarillo_pose_library", "version": 2, "library_name": "Broken", "poses": [{"name": "A", "data": "APL1:not base64"}, 1]}))
+
+    assert pose_library_tool.main(["--jobs", "1", "validate", str(good)]) == 0
+    assert pose_library_tool.main(["--jobs", "1", "--json", "validate", str(broken)]) == 1
+    report = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert report["poses"] == 2
+    assert len(report["errors"]) == 2
+
+def test_merge_dedupes_and_renames(tmp_path):
+    first = tmp_path / "first.json"
+    second = tmp_path / "second.json"
+    write_export(first, "First", [("A", make_pose(0)), ("B", make_pose(1))])
+    write_export(second, "Second", [("A", make_pose(2)), ("Copy", make_pose(0))])
+    output = tmp_path / "merged.json"
+
+    assert pose_library_tool.main(["merge", str(output), str(first), str(second), "--dedupe", "--library-name", "All"]) == 0
+    merged = json.loads(output.read_text())
+    assert merged["library_name"] == "All"
+    assert [entry["name"] for entry in merged["poses"]] == ["A", "B", "A (2)"]
+    assert_same_pose(make_pose(2), pose_from_export_data(merged["poses"][2]["pose"]))
+
+def test_convert_upgrades_legacy_exports(tmp_path):
+    pose = make_pose(armature_names=("Rig",))
+    source = tmp_path / "old.json"
+    source.write_text(json.dumps({"library_name": "Old", "poses": [{"name": "A", "data": legacy_payload(pose)}]}))
+    output_dir = tmp_path / "upgraded"
+
+    assert pose_library_tool.main(["--jobs", "1", "convert", "--output-dir", str(output_dir), str(source)]) == 0
+    converted = json.loads((output_dir / "old.json").read_text())
+    assert converted["format"] == library_format.LIBRARY_FILE_FORMAT
+    assert converted["library_name"] == "Old"
+    assert_same_pose(pose, pose_from_export_data(converted["poses"][0]["pose"]))
+
+def test_convert_keeps_archives_as_archives(tmp_path):
+    source = tmp_path / "libraries.zip"
+    write_library_archive(str(source), [("First", [("Pose", encode_pose_payload(make_pose()), "")])])
+    output_dir = tmp_path / "out"
+
+    assert pose_library_tool.main(["--jobs", "1", "convert", "--output-dir", str(output_dir), str(source)]) == 0
+    assert zipfile.is_zipfile(output_dir / "libraries.zip")
+
+def test_compact_leaves_out_rest_bones(tmp_path):
+    values = numpy.tile(REST_POSE_VALUES, (3, 1))
+    values[1, 0] = 1.0
+    source = tmp_path / "library.json"
+    write_export(source, "Library", [("A", {"Rig": ArmaturePose(["a", "b", "c"], values)})])
+    output_dir = tmp_path / "small"
+
+    assert pose_library_tool.main(["--jobs", "1", "compact", "--output-dir", str(output_dir), str(source)]) == 0
+    compacted = json.loads((output_dir / "library.json").read_text())
+    assert compacted["poses"][0]["pose"]["Rig"]["bones"] == ["b"]
+
+def test_transform_refuses_to_overwrite_inputs(tmp_path):
+    source = tmp_path / "library.json"
+    write_export(source, "Library", [("A", make_pose())])
+    assert pose_library_tool.main(["dedupe", "--output-dir", str(tmp_path), str(source)]) == 2
+
+def test_layout_key_follows_bone_order():
+    values = numpy.tile(REST_POSE_VALUES, (2, 1))
+    assert ArmaturePose(["a", "b"], values).layout_key == ArmaturePose(["a", "b"], values.copy()).layout_key
+    assert ArmaturePose(["a", "b"], values).layout_key != ArmaturePose(["b", "a"], values).layout_key